@@ -0,0 +1,569 @@
+#!/usr/bin/env python
+
+"""
+benchmark.py -- ConferenceApi benchmark on the App Engine testbed
+    seeds the local datastore & memcache stubs, drives every API method
+    and reports ops/sec, latency percentiles & RPC counts
+
+usage: python benchmark.py [--sdk PATH] [--conferences N] [--sessions N]
+           [--profiles N] [--wishlists N] [--ops N] [--burst N]
+           [--conversions N] [--save baseline.json] [--compare baseline.json]
+
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date
+from datetime import time as time_of_day
+from datetime import timedelta
+
+import testing
+
+PERCENTILES = (50, 90, 99)
+
+CITIES = ['London', 'Chicago', 'Paris', 'Tokyo', 'San Francisco', 'Berlin']
+TOPICS = ['Medical Innovations', 'Programming Languages', 'Web Technologies',
+          'Movie Making', 'Health and Nutrition']
+SESSION_TYPES = ['Workshop', 'Lecture', 'Keynote', 'Panel']
+SPEAKERS = ['Speaker %d' % i for i in range(25)]
+# getWishlistBySpeaker on a conference with many sessions & a long wishlist
+BIG_CONFERENCE_SESSIONS = 1000
+BIG_WISHLIST = 200
+
+# queryConferences filter sets: name -> list of (field, operator, value)
+QUERY_FILTERS = [
+    ('none', []),
+    ('city', [('CITY', 'EQ', 'London')]),
+    ('topicMonth', [('TOPIC', 'EQ', 'Medical Innovations'),
+                    ('MONTH', 'EQ', '6')]),
+    ('maxAttendees', [('MAX_ATTENDEES', 'GT', '100')]),
+    ('cityMaxAttendees', [('CITY', 'EQ', 'Paris'),
+                          ('MAX_ATTENDEES', 'GT', '10')]),
+    ('twoInequalities', [('MAX_ATTENDEES', 'GT', '10'),
+                         ('MONTH', 'LT', '9')]),
+]
+
+
+def _percentile(values, pct):
+    """Return the pct'th percentile of sorted values."""
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def _reflectiveConferenceToForm(conf):
+    """Copy a Conference to a ConferenceForm the way ConferenceApi did
+    before the copiers; the baseline of the conversion benchmark."""
+    from models import ConferenceForm
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            # convert Date to date string; just copy others
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.check_initialized()
+    return cf
+
+
+def _reflectiveSessionToForm(sess):
+    """Copy a Session to a SessionForm the way ConferenceApi did before
+    the copiers."""
+    from models import SessionForm
+    cf = SessionForm()
+    for field in cf.all_fields():
+        if hasattr(sess, field.name):
+            if field.name.endswith('Time') or field.name.endswith('date'):
+                setattr(cf, field.name, str(getattr(sess, field.name)))
+            else:
+                setattr(cf, field.name, getattr(sess, field.name))
+    cf.check_initialized()
+    return cf
+
+
+class Benchmark(object):
+    """Seeded testbed plus the operations driven against ConferenceApi."""
+
+    def __init__(self, args):
+        from google.appengine.ext import ndb
+        import conference
+        import metrics
+        import models
+
+        self.args = args
+        self.ndb = ndb
+        self.conference = conference
+        self.metrics = metrics
+        self.models = models
+        self.random = random.Random(args.seed)
+        self.results = {}
+
+        self.testbed = testing.activateTestbed()
+
+
+    def close(self):
+        self.testbed.deactivate()
+
+# - - - Seeding - - - - - - - - - - - - - - - - - - - - - - -
+
+    def seed(self):
+        """Write profiles, conferences, sessions & wishlists directly."""
+        ndb, models = self.ndb, self.models
+        ConferenceApi = self.conference.ConferenceApi
+        rnd = self.random
+
+        self.emails = ['user%d@example.com' % i
+                       for i in range(self.args.profiles)]
+        ndb.put_multi([models.Profile(key=ndb.Key(models.Profile, email),
+                                      displayName=email.split('@')[0],
+                                      mainEmail=email,
+                                      teeShirtSize='NOT_SPECIFIED')
+                       for email in self.emails])
+
+        confs = []
+        for i in range(self.args.conferences):
+            organizer = self.emails[i % len(self.emails)]
+            start = date(2026, 1, 1) + timedelta(days=rnd.randrange(365))
+            seats = rnd.randrange(10, 500)
+            conf = models.Conference(
+                key=ndb.Key(models.Conference, i + 1,
+                            parent=ndb.Key(models.Profile, organizer)),
+                name='Conference %d' % i,
+                description='Benchmark conference %d' % i,
+                organizerUserId=organizer,
+                organizerDisplayName=organizer.split('@')[0],
+                topics=rnd.sample(TOPICS, 2),
+                city=rnd.choice(CITIES),
+                startDate=start,
+                month=start.month,
+                endDate=start + timedelta(days=2),
+                maxAttendees=seats,
+                seatsAvailable=seats)
+            confs.append(conf)
+        shards = []
+        for conf in confs:
+            shards.extend(ConferenceApi._makeSeatShards(conf))
+        for i in range(0, len(shards + confs), 500):
+            ndb.put_multi((shards + confs)[i:i + 500])
+        self.conf_keys = [conf.key for conf in confs]
+
+        for c_key in self.conf_keys:
+            ConferenceApi._putSessions(c_key, [self._sessionData(i)
+                for i in range(self.args.sessions)])
+        self.session_keys = models.Session.query().fetch(keys_only=True)
+
+        wishes = []
+        for email in self.emails:
+            for s_key in rnd.sample(self.session_keys,
+                    min(self.args.wishlists, len(self.session_keys))):
+                wishes.append(models.Wishlist(
+                    key=ndb.Key(models.Wishlist, s_key.urlsafe(),
+                                parent=ndb.Key(models.Profile, email)),
+                    sessionName='Session', userId=email, sessionKey=s_key,
+                    typeOfSession=[rnd.choice(SESSION_TYPES)]))
+        for i in range(0, len(wishes), 500):
+            ndb.put_multi(wishes[i:i + 500])
+        testing.clearCaches()
+
+
+    def seedBigWishlist(self):
+        """Write a conference of BIG_CONFERENCE_SESSIONS sessions and a user
+        with BIG_WISHLIST of them on their wishlist; returns the user."""
+        ndb, models = self.ndb, self.models
+        email = 'wishlister@example.com'
+        p_key = ndb.Key(models.Profile, email)
+        conf = models.Conference(
+            key=ndb.Key(models.Conference, len(self.conf_keys) + 1,
+                        parent=p_key),
+            name='Big conference', organizerUserId=email,
+            organizerDisplayName='wishlister', city='London',
+            maxAttendees=1000, seatsAvailable=1000)
+        ndb.put_multi([models.Profile(key=p_key, displayName='wishlister',
+                                      mainEmail=email,
+                                      teeShirtSize='NOT_SPECIFIED'), conf])
+        datas = [self._sessionData(i) for i in range(BIG_CONFERENCE_SESSIONS)]
+        self.conference.ConferenceApi._putSessions(conf.key, datas)
+        ndb.put_multi([models.Wishlist(
+            key=ndb.Key(models.Wishlist, data['key'].urlsafe(), parent=p_key),
+            sessionName=data['name'], userId=email, sessionKey=data['key'],
+            typeOfSession=data['typeOfSession'])
+            for data in self.random.sample(datas, BIG_WISHLIST)])
+        testing.clearCaches()
+        return email
+
+
+    def conversionEntities(self, count):
+        """Return count in-memory Conferences & Sessions to convert."""
+        ndb, models = self.ndb, self.models
+        rnd = self.random
+        confs, sessions = [], []
+        for i in range(count):
+            p_key = ndb.Key(models.Profile, self.emails[i % len(self.emails)])
+            start = date(2026, 1, 1) + timedelta(days=rnd.randrange(365))
+            conf = models.Conference(
+                key=ndb.Key(models.Conference, i + 1, parent=p_key),
+                name='Conference %d' % i, description='Converted',
+                organizerUserId=p_key.id(), organizerDisplayName='organizer',
+                topics=rnd.sample(TOPICS, 2), city=rnd.choice(CITIES),
+                startDate=start, month=start.month,
+                endDate=start + timedelta(days=2),
+                maxAttendees=100, seatsAvailable=100)
+            confs.append(conf)
+            data = self._sessionData(i)
+            data['key'] = ndb.Key(models.Session, i + 1, parent=conf.key)
+            sessions.append(models.Session(**data))
+        return confs, sessions
+
+
+    def _sessionData(self, i):
+        """Return dict of a random Session for _putSessions()."""
+        rnd = self.random
+        return {
+            'name': 'Session %d' % i,
+            'highlights': 'Benchmark session',
+            'speaker': rnd.choice(SPEAKERS),
+            'typeOfSession': rnd.sample(SESSION_TYPES, 2),
+            'duration': rnd.choice([30, 45, 60, 90]),
+            'date': date(2026, 6, 1) + timedelta(days=rnd.randrange(3)),
+            'startTime': time_of_day(rnd.randrange(8, 18),
+                                     rnd.choice([0, 15, 30, 45])),
+        }
+
+# - - - Running - - - - - - - - - - - - - - - - - - - - - - -
+
+    def call(self, email, method, request):
+        """Call an API method as a fresh request of user email."""
+        os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+        self.ndb.get_context().clear_cache()
+        api = self.conference.ConferenceApi()
+        return getattr(api, method)(request)
+
+
+    def run(self, name, op, count=None, setup=None):
+        """Time op(i) for count iterations, recording latency & RPCs;
+        setup(i), if given, runs untimed before each."""
+        count = count or self.args.ops
+        latencies, errors = [], 0
+        totals = dict.fromkeys(self.metrics.METRICS_FIELDS[1:], 0)
+        started = time.time()
+        for i in range(count):
+            if setup:
+                setup(i)
+            self.metrics.startCounting()
+            start = time.time()
+            try:
+                op(i)
+            except Exception as e:
+                errors += 1
+                if errors == 1:
+                    print '  %s: %s: %s' % (name, type(e).__name__, e)
+            latencies.append((time.time() - start) * 1000)
+            for field, n in self.metrics.stopCounting().iteritems():
+                totals[field] += n
+        elapsed = time.time() - started
+
+        latencies.sort()
+        result = {
+            'ops': count,
+            'errors': errors,
+            'opsPerSec': count / elapsed if elapsed else 0,
+            'rpcs': dict((field, float(n) / count)
+                         for field, n in totals.iteritems()),
+        }
+        for pct in PERCENTILES:
+            result['p%dMs' % pct] = _percentile(latencies, pct)
+        self.results[name] = result
+        return result
+
+# - - - Scenarios - - - - - - - - - - - - - - - - - - - - - - -
+
+    def scenarios(self):
+        """Run every scenario; returns the API methods left undriven."""
+        ndb, models, conference = self.ndb, self.models, self.conference
+        from models import ConferenceForm
+        from models import ConferenceQueryForm
+        from models import ConferenceQueryForms
+        from models import ProfileMiniForm
+        from models import SessionForm
+        from models import SessionForms
+        from models import SessionQuery
+        from models import SessionQuerySpeaker
+        from models import SessionQueryType
+        from models import SessionSearchForm
+        from models import TeeShirtSize
+        from models import WishlistForm
+        from models import WishlistSpeakerQuery
+        from models import WishlistTypeQuery
+        from protorpc import message_types
+        void = message_types.VoidMessage()
+        rnd = self.random
+        driven = set()
+
+        def user(i):
+            return self.emails[i % len(self.emails)]
+
+        def wsck(i):
+            return self.conf_keys[i % len(self.conf_keys)].urlsafe()
+
+        def owner(i):
+            return self.conf_keys[i % len(self.conf_keys)].parent().id()
+
+        def run(name, method, op, count=None, setup=None):
+            driven.add(method)
+            self.run(name, op, count, setup)
+
+        def bumpGeneration(i):
+            conference.ConferenceApi._bumpConferenceGeneration()
+
+        def confGet(i):
+            return conference.CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=wsck(i))
+
+        # conferences
+        run('createConference', 'createConference',
+            lambda i: self.call(user(i), 'createConference', ConferenceForm(
+                name='New conference %d' % i, city=rnd.choice(CITIES),
+                topics=rnd.sample(TOPICS, 2), startDate='2026-06-01',
+                endDate='2026-06-03', maxAttendees=100)))
+        run('updateConference', 'updateConference',
+            lambda i: self.call(owner(i), 'updateConference',
+                conference.CONF_POST_REQUEST.combined_message_class(
+                    websafeConferenceKey=wsck(i),
+                    description='Updated %d' % i)))
+        run('getConference', 'getConference',
+            lambda i: self.call(user(i), 'getConference', confGet(i)))
+        run('getConferencesCreated', 'getConferencesCreated',
+            lambda i: self.call(user(i), 'getConferencesCreated',
+                conference.CONF_FIELDS_REQUEST.combined_message_class()))
+        run('getConferencesCreated[fields]', 'getConferencesCreated',
+            lambda i: self.call(user(i), 'getConferencesCreated',
+                conference.CONF_FIELDS_REQUEST.combined_message_class(
+                    fields=['name', 'city'])))
+
+        # each filter set cold, with the response cache expired before
+        # every call, then warm, served from the response cache
+        queries = [(name, ConferenceQueryForms(filters=[
+                       ConferenceQueryForm(field=f, operator=o, value=v)
+                       for f, o, v in filters]))
+                   for name, filters in QUERY_FILTERS]
+        queries.append(('fields', ConferenceQueryForms(
+            fields=['name', 'city'], pageSize=20)))
+        for name, request in queries:
+            op = lambda i, request=request: self.call(
+                user(i), 'queryConferences', request)
+            run('queryConferences[%s][cold]' % name, 'queryConferences', op,
+                setup=bumpGeneration)
+            run('queryConferences[%s][warm]' % name, 'queryConferences', op)
+        run('filterPlayground', 'filterPlayground',
+            lambda i: self.call(user(i), 'filterPlayground', void))
+
+        # sessions
+        run('createSession', 'createSession',
+            lambda i: self.call(owner(i), 'createSession', SessionForm(
+                name='New session %d' % i, speaker=rnd.choice(SPEAKERS),
+                typeOfSession=['Workshop'], duration=60, date='2026-06-01',
+                startTime='10:00', confwebsafeKey=wsck(i))))
+        run('createSessions[10]', 'createSessions',
+            lambda i: self.call(owner(i), 'createSessions', SessionForms(
+                items=[SessionForm(name='Batch session %d-%d' % (i, j),
+                                   speaker=rnd.choice(SPEAKERS),
+                                   typeOfSession=['Lecture'], duration=45,
+                                   date='2026-06-02', startTime='14:00',
+                                   confwebsafeKey=wsck(i))
+                       for j in range(10)])))
+        run('getSessionBySpeaker', 'getSessionBySpeaker',
+            lambda i: self.call(user(i), 'getSessionBySpeaker',
+                SessionQuerySpeaker(speaker=rnd.choice(SPEAKERS))))
+        run('getConferenceSessionsByType', 'getConferenceSessionsByType',
+            lambda i: self.call(user(i), 'getConferenceSessionsByType',
+                SessionQueryType(websafeConferenceKey=wsck(i),
+                                 typeOfSession=rnd.choice(SESSION_TYPES))))
+        run('getConferenceSessions', 'getConferenceSessions',
+            lambda i: self.call(user(i), 'getConferenceSessions',
+                SessionQuery(websafeConferenceKey=wsck(i))))
+        run('searchSessions', 'searchSessions',
+            lambda i: self.call(user(i), 'searchSessions', SessionSearchForm(
+                websafeConferenceKey=wsck(i), startTimeFrom='09:00',
+                startTimeTo='16:00', excludeTypes=['Workshop'])))
+        run('getConferenceSessionsProblem', 'getConferenceSessionsProblem',
+            lambda i: self.call(user(i), 'getConferenceSessionsProblem',
+                SessionQuery(websafeConferenceKey=wsck(i))))
+        run('getFeaturedSpeaker', 'getFeaturedSpeaker',
+            lambda i: self.call(user(i), 'getFeaturedSpeaker',
+                SessionQuery(websafeConferenceKey=wsck(i))))
+
+        # wishlists; each user adds sessions not already on their list
+        unlisted = {}
+        for email in self.emails:
+            listed = set(w.sessionKey for w in models.Wishlist.query(
+                ancestor=ndb.Key(models.Profile, email)))
+            unlisted[email] = [k for k in self.session_keys if k not in listed]
+        run('addSessionToWishlist', 'addSessionToWishlist',
+            lambda i: self.call(user(i), 'addSessionToWishlist', WishlistForm(
+                sessionKey=unlisted[user(i)].pop().urlsafe())))
+        run('getSessionsInWishlist', 'getSessionsInWishlist',
+            lambda i: self.call(user(i), 'getSessionsInWishlist', void))
+        run('getWishlistBySpeaker', 'getWishlistBySpeaker',
+            lambda i: self.call(user(i), 'getWishlistBySpeaker',
+                WishlistSpeakerQuery(speaker=rnd.choice(SPEAKERS))))
+        wishlister = self.seedBigWishlist()
+        run('getWishlistBySpeaker[%d sessions, %d wishes]' % (
+                BIG_CONFERENCE_SESSIONS, BIG_WISHLIST), 'getWishlistBySpeaker',
+            lambda i: self.call(wishlister, 'getWishlistBySpeaker',
+                WishlistSpeakerQuery(speaker=rnd.choice(SPEAKERS))))
+        run('getWishlistByType', 'getWishlistByType',
+            lambda i: self.call(user(i), 'getWishlistByType',
+                WishlistTypeQuery(typeOfSession=rnd.choice(SESSION_TYPES))))
+
+        # profiles & announcements
+        run('getProfile', 'getProfile',
+            lambda i: self.call(user(i), 'getProfile', void))
+        run('saveProfile', 'saveProfile',
+            lambda i: self.call(user(i), 'saveProfile', ProfileMiniForm(
+                displayName='Renamed %d' % i, teeShirtSize=TeeShirtSize.M_M)))
+        run('getAnnouncement', 'getAnnouncement',
+            lambda i: self.call(user(i), 'getAnnouncement', void))
+
+        # registration bursts: many users on one conference
+        burst = min(self.args.burst, len(self.emails))
+        target = confGet(0)
+        run('registerForConference[burst]', 'registerForConference',
+            lambda i: self.call(self.emails[i], 'registerForConference',
+                                target), burst)
+        run('getConferencesToAttend', 'getConferencesToAttend',
+            lambda i: self.call(user(i), 'getConferencesToAttend', void))
+        run('unregisterFromConference[burst]', 'unregisterFromConference',
+            lambda i: self.call(self.emails[i], 'unregisterFromConference',
+                                target), burst)
+
+        tickets = []
+        run('queueRegistrationForConference[burst]',
+            'queueRegistrationForConference',
+            lambda i: tickets.append((self.emails[i], self.call(
+                self.emails[i], 'queueRegistrationForConference',
+                target).ticket)), burst)
+        self.run('processRegistrations[task]', lambda i:
+            conference.ConferenceApi._processRegistrations(
+                target.websafeConferenceKey), 1)
+        run('getRegistrationStatus', 'getRegistrationStatus',
+            lambda i: self.call(tickets[i % len(tickets)][0],
+                'getRegistrationStatus',
+                conference.REG_GET_REQUEST.combined_message_class(
+                    ticket=tickets[i % len(tickets)][1])))
+        run('queueUnregistrationFromConference[burst]',
+            'queueUnregistrationFromConference',
+            lambda i: self.call(self.emails[i],
+                'queueUnregistrationFromConference', target), burst)
+
+        return sorted(set(conference.ConferenceApi.all_remote_methods()) -
+                      driven)
+
+
+    def conversions(self):
+        """Time entity to form conversion, reflective vs copiers, over
+        --conversions entities; returns the number of differing forms."""
+        confs, sessions = self.conversionEntities(self.args.conversions)
+        api = self.conference.ConferenceApi()
+        count = len(confs)
+        self.run('copyConferenceToForm[reflective]',
+                 lambda i: _reflectiveConferenceToForm(confs[i]), count)
+        self.run('copyConferenceToForm[copier]',
+                 lambda i: api._copyConferenceToForm(confs[i]), count)
+        self.run('copySessionToForm[reflective]',
+                 lambda i: _reflectiveSessionToForm(sessions[i]), count)
+        self.run('copySessionToForm[copier]',
+                 lambda i: api._copySessionToForm(sessions[i]), count)
+        return sum(
+            (_reflectiveConferenceToForm(conf) != api._copyConferenceToForm(conf)) +
+            (_reflectiveSessionToForm(sess) != api._copySessionToForm(sess))
+            for conf, sess in zip(confs, sessions))
+
+# - - - Reporting - - - - - - - - - - - - - - - - - - - - - - -
+
+def report(results, baseline=None):
+    """Print results, with changes against baseline results if given."""
+    header = '%-42s %8s %8s %8s %8s  %s' % (
+        'operation', 'ops/sec', 'p50 ms', 'p90 ms', 'p99 ms',
+        'get/query/put  mc hit/miss  tasks')
+    print header
+    print '-' * len(header)
+    for name in sorted(results):
+        r = results[name]
+        rpcs = r['rpcs']
+        print '%-42s %8.1f %8.2f %8.2f %8.2f  %4.1f/%4.1f/%4.1f  %5.1f/%5.1f  %5.1f%s' % (
+            name, r['opsPerSec'], r['p50Ms'], r['p90Ms'], r['p99Ms'],
+            rpcs['datastoreGets'], rpcs['datastoreQueries'],
+            rpcs['datastorePuts'], rpcs['memcacheHits'],
+            rpcs['memcacheMisses'], rpcs['tasks'],
+            '  (%d errors)' % r['errors'] if r['errors'] else '')
+        old = (baseline or {}).get(name)
+        if old:
+            changes = ['p50 %+.0f%%' % (100.0 * (r['p50Ms'] - old['p50Ms']) /
+                                       (old['p50Ms'] or 1))]
+            for field, n in sorted(rpcs.iteritems()):
+                if abs(n - old['rpcs'].get(field, 0)) >= 0.05:
+                    changes.append('%s %+.1f' % (field,
+                                   n - old['rpcs'].get(field, 0)))
+            print '%-42s %s' % ('  vs baseline', ', '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sdk', default=testing.DEFAULT_SDK,
+        help='App Engine SDK directory')
+    parser.add_argument('--conferences', type=int, default=200)
+    parser.add_argument('--sessions', type=int, default=20,
+                        help='sessions per conference')
+    parser.add_argument('--profiles', type=int, default=200)
+    parser.add_argument('--wishlists', type=int, default=10,
+                        help='wishlist entries per profile')
+    parser.add_argument('--ops', type=int, default=50,
+                        help='calls per operation')
+    parser.add_argument('--burst', type=int, default=100,
+                        help='users in each registration burst')
+    parser.add_argument('--conversions', type=int, default=10000,
+                        help='entities in the form conversion benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='write results as baseline JSON')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    args = parser.parse_args()
+
+    if not testing.setupPath(args.sdk):
+        sys.exit('App Engine SDK not found in %s' % args.sdk)
+    bench = Benchmark(args)
+    try:
+        started = time.time()
+        bench.seed()
+        print 'seeded %d conferences, %d sessions, %d profiles in %.1fs' % (
+            args.conferences, len(bench.session_keys), args.profiles,
+            time.time() - started)
+        undriven = bench.scenarios()
+        differing = bench.conversions()
+    finally:
+        bench.close()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    report(bench.results, baseline)
+    if undriven:
+        print 'not benchmarked: %s' % ', '.join(undriven)
+    if differing:
+        print 'copiers & reflective copies differ on %d forms' % differing
+
+    if args.save:
+        config = dict((k, v) for k, v in vars(args).iteritems()
+                      if k not in ('sdk', 'save', 'compare'))
+        with open(args.save, 'w') as f:
+            json.dump({'config': config, 'results': bench.results}, f,
+                      indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,17 +13,29 @@ created by wesc on 2014 apr 21
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 
+from bisect import bisect_left
+from bisect import bisect_right
+from collections import OrderedDict
 from datetime import datetime
+import hashlib
+import json
+import operator
+import random
+import threading
 import time
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
+from google.net.proto.ProtocolBuffer import ProtocolBufferDecodeError
 import logging
 logging.getLogger().setLevel(logging.DEBUG)
 
@@ -36,9 +48,17 @@ from models import BooleanMessage
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
+from models import SeatShard
+from models import Notification
+from models import AlmostSoldOut
+from models import PendingRegistration
+from models import RegistrationStatus
+from models import RegistrationTicketForm
 from models import SessionForm
 from models import SessionForms
+from models import FeaturedSpeakerForm
 from models import Session
+from models import Speaker
 from models import WishlistForm
 from models import WishlistForms
 from models import Wishlist
@@ -48,6 +68,7 @@ from models import WishlistTypeQuery
 from models import SessionQuerySpeaker
 from models import SessionQueryType
 from models import SessionQuery
+from models import SessionSearchForm
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
 from models import TeeShirtSize
@@ -59,13 +80,58 @@ from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
 
 from utils import getUserId
+from metrics import MetricsMiddleware
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-MEMCACHE_FEATURED_KEY = "FEATURED_SPEAKER"
-ANNOUNCEMENT_TPL = 'Last chance to attend!'
+MEMCACHE_FEATURED_PREFIX = "FEATURED_SPEAKER:"
+MEMCACHE_TIMETABLE_PREFIX = "SESSION_TIMETABLE:"
+TIMETABLE_CACHE_TTL = 600
+# Sessions per transaction; with their Speakers they must stay below
+# the 500 entities a commit can write
+SESSION_PUT_BATCH_SIZE = 200
+IMPORT_BATCH_SIZE = 300             # lines per import task
+IMPORT_TASK_BYTES = 90000           # stay below the 100KB task payload limit
+EXPORT_BATCH_SIZE = 300             # entities per datastore page
+EXPORT_MAX_ENTITIES = 3000          # entities per export response
+# record confirmation emails for the notifications cron to send as one
+# digest per recipient, instead of a task & email per Conference
+CONFIRMATION_EMAIL_DIGEST = True
+NOTIFICATION_BATCH_SIZE = 500
+# how long a sent confirmation email task is remembered, so a
+# replayed task doesn't send the email again
+MEMCACHE_SENT_EMAIL_PREFIX = 'SENT_EMAIL:'
+SENT_EMAIL_TTL = 60 * 60 * 24
+ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
+                    'are nearly sold out: %s')
+MEMCACHE_ALMOST_SOLD_OUT_KEY = "ALMOST_SOLD_OUT"
+ALMOST_SOLD_OUT_SEATS = 5           # seats left to count as almost sold out
+ALMOST_SOLD_OUT_BATCH_SIZE = 200    # conferences rechecked per cron run
 ANNOUNCEMENT_FT = "Today's featured speaker is "
+MAX_PAGE_SIZE = 100
+MIGRATION_BATCH_SIZE = 20
+ORGANIZER_BATCH_SIZE = 100
+MEMCACHE_CONFERENCE_PREFIX = "CONFERENCE_FORM:"
+MEMCACHE_CONFERENCE_STATS_PREFIX = "CONFERENCE_CACHE_"
+CONFERENCE_CACHE_TTL = 300          # seconds in memcache
+CONFERENCE_LOCAL_CACHE_TTL = 5      # seconds in the per-instance LRU
+CONFERENCE_LOCAL_CACHE_SIZE = 500
+CONFERENCE_CACHE_STATS_FLUSH = 100  # lookups between counter flushes
+MEMCACHE_SEATS_PREFIX = "SEATS_AVAILABLE:"
+MEMCACHE_QUERY_PREFIX = "QUERY_CONFERENCES:"
+MEMCACHE_CONFERENCE_GENERATION_KEY = "CONFERENCE_GENERATION"
+QUERY_CACHE_TTL = 600
+QUERY_INDEX_DELAY = 5               # seconds until queries see a write
+SEATS_CACHE_TTL = 60
+# must stay below the 25 entity group limit of XG transactions
+NUM_SEAT_SHARDS = 20
+# queued registrations touch one Profile entity group each plus a shard
+REGISTRATION_BATCH_SIZE = 20
+REGISTRATION_BATCHES_PER_TASK = 10
+REGISTRATION_QUEUE_DELAY = 2        # seconds to collect a batch
+# tickets pending this long have been missed by the worker; requeue them
+REGISTRATION_STALE_AFTER = 4 * (REGISTRATION_QUEUE_DELAY + QUERY_INDEX_DELAY)
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -95,16 +161,183 @@ FIELDS =    {
             'MAX_ATTENDEES': 'maxAttendees',
             }
 
+# in-memory equivalents of OPERATORS, for filters not sent to the datastore
+COMPARATORS = {
+            '=':  operator.eq,
+            '>':  operator.gt,
+            '>=': operator.ge,
+            '<':  operator.lt,
+            '<=': operator.le,
+            '!=': operator.ne,
+            }
+
+# tie-break when choosing which inequality field the datastore handles
+INEQUALITY_PREFERENCE = ['month', 'maxAttendees', 'city', 'topics']
+
+# ConferenceForm fields that list views can get from a projection query;
+# websafeKey and seatsAvailable are always filled in without one
+# not organizerDisplayName: Conferences written before it was stored
+# don't have it, and a projection query would leave them out
+PROJECTION_FIELDS = ('name', 'city', 'topics', 'startDate', 'endDate',
+                     'month', 'maxAttendees', 'organizerUserId')
+
+
+class LRUCache(object):
+    """LRUCache -- small thread-safe per-instance cache with expiring entries"""
+
+    def __init__(self, size, ttl):
+        self._size = size
+        self._ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return cached value or None if missing or expired."""
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None or item[1] < time.time():
+                return None
+            # re-insert to mark as most recently used
+            self._items[key] = item
+            return item[0]
+
+    def set(self, key, value):
+        """Cache value, evicting the least recently used entries."""
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, time.time() + self._ttl)
+            while len(self._items) > self._size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        """Drop key from the cache."""
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        """Drop all entries."""
+        with self._lock:
+            self._items.clear()
+
+
+# serialized ConferenceForms by websafe key; entries on other instances
+# can't be invalidated, so they only live for CONFERENCE_LOCAL_CACHE_TTL
+_conference_cache = LRUCache(CONFERENCE_LOCAL_CACHE_SIZE,
+                             CONFERENCE_LOCAL_CACHE_TTL)
+# hit/miss counts not yet flushed to memcache
+_conference_cache_stats = {'hits': 0, 'misses': 0}
+_conference_cache_stats_lock = threading.Lock()
+
+
+def _fieldConverter(prop, field):
+    """Return function converting values of an ndb property for a form
+    field, or None if they are copied as is."""
+    if isinstance(field, messages.EnumField):
+        # stored as the enum name
+        convert = lambda value: getattr(field.type, value)
+    elif isinstance(field, messages.StringField) and \
+            isinstance(prop, ndb.DateTimeProperty):
+        # Date/Time to string
+        convert = str
+    elif isinstance(field, messages.StringField) and \
+            isinstance(prop, ndb.KeyProperty):
+        convert = lambda key: key.urlsafe()
+    else:
+        return None
+    if prop._repeated:
+        return lambda values: [convert(value) for value in values]
+    return convert
+
+
+def _formCopier(model, form):
+    """Return (field name, converter) pairs to copy a model to a form
+    message; worked out once, so copies don't reflect over all fields."""
+    props = dict((prop._code_name, prop) for prop in model._properties.values())
+    return [(field.name, _fieldConverter(props[field.name], field))
+            for field in sorted(form.all_fields(), key=lambda f: f.number)
+            if field.name in props]
+
+
+def _copyFields(copier, entity, form):
+    """Copy entity values to form using a copier from _formCopier()."""
+    for name, convert in copier:
+        value = getattr(entity, name)
+        setattr(form, name, convert(value) if convert else value)
+
+
+CONFERENCE_COPIER = _formCopier(Conference, ConferenceForm)
+SESSION_COPIER = _formCopier(Session, SessionForm)
+PROFILE_COPIER = _formCopier(Profile, ProfileForm)
+
+
+def _entityToJson(entity):
+    """Return entity as a JSON-able dict of kind, flat key & properties."""
+    properties = {}
+    for prop in entity._properties.values():
+        value = prop._get_value(entity)
+        if isinstance(prop, (ndb.DateProperty, ndb.TimeProperty)):
+            convert = lambda v: v.isoformat()
+        elif isinstance(prop, ndb.KeyProperty):
+            convert = lambda v: list(v.flat())
+        else:
+            convert = lambda v: v
+        if prop._repeated:
+            value = [convert(v) for v in value]
+        elif value is not None:
+            value = convert(value)
+        properties[prop._code_name] = value
+    return {'kind': entity._get_kind(), 'key': list(entity.key.flat()),
+            'properties': properties}
+
+
+def _entityFromJson(model, record):
+    """Return a model entity from a dict made by _entityToJson()."""
+    props = dict((prop._code_name, prop) for prop in model._properties.values())
+    values = {}
+    for name, value in record['properties'].iteritems():
+        prop = props[name]
+        if isinstance(prop, ndb.DateProperty):
+            convert = lambda v: datetime.strptime(v, "%Y-%m-%d").date()
+        elif isinstance(prop, ndb.TimeProperty):
+            convert = lambda v: datetime.strptime(v, "%H:%M:%S").time()
+        elif isinstance(prop, ndb.KeyProperty):
+            convert = lambda v: ndb.Key(flat=v)
+        else:
+            convert = lambda v: v
+        if prop._repeated:
+            value = [convert(v) for v in value or []]
+        elif value is not None:
+            value = convert(value)
+        values[name] = value
+    return model(key=ndb.Key(flat=record['key']), **values)
+
+
+# kinds handled by bulk import & export
+TRANSFER_KINDS = {
+    'Conference': Conference,
+    'Session': Session,
+}
+
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_FIELDS_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    fields=messages.StringField(1, repeated=True),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
 )
 
+REG_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ticket=messages.StringField(1),
+)
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
@@ -116,31 +349,316 @@ class ConferenceApi(remote.Service):
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf, displayName=None):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+        cf = ConferenceForm(websafeKey=conf.key.urlsafe())
+        _copyFields(CONFERENCE_COPIER, conf, cf)
         if displayName:
             setattr(cf, 'organizerDisplayName', displayName)
         cf.check_initialized()
         return cf
 
 
+    def _copyConferenceFieldsToForm(self, conf, fields, topics=None):
+        """Copy only the given fields from a (projected) Conference to a
+        ConferenceForm; topics overrides conf.topics if given."""
+        cf = ConferenceForm(websafeKey=conf.key.urlsafe())
+        converters = dict(CONFERENCE_COPIER)
+        for name in fields:
+            if name not in converters or name == 'seatsAvailable':
+                continue
+            if name == 'topics' and topics is not None:
+                value = topics
+            else:
+                value = getattr(conf, name)
+            # convert Date to date string; just copy others
+            if converters[name] and value is not None:
+                value = converters[name](value)
+            setattr(cf, name, value)
+        cf.check_initialized()
+        return cf
+
+
+    def _checkFields(self, fields):
+        """Validate a fields selector, returning the field names or None
+        if all fields were asked for."""
+        if not fields:
+            return None
+        names = set(field.name for field in ConferenceForm.all_fields())
+        unknown = [name for name in fields if name not in names]
+        if unknown:
+            raise endpoints.BadRequestException(
+                "Unknown field(s): %s" % ", ".join(unknown))
+        return list(fields)
+
+
+    def _getProjection(self, fields, plan=None, paged=False):
+        """Return the properties to project for fields, or None if the
+        query has to fetch whole entities."""
+        if fields is None:
+            return None
+        pushdown = plan["pushdown"] if plan else []
+        residual = plan["residual"] if plan else []
+        projection = set(["name"] + [f["field"] for f in residual])
+        for name in fields:
+            if name in PROJECTION_FIELDS:
+                projection.add(name)
+            elif name not in ('websafeKey', 'seatsAvailable'):
+                return None
+
+        # the datastore can't project properties it filters on by
+        # equality; projecting topics yields one row per topic, which
+        # can't be merged across pages or matched against filters
+        if projection & set(f["field"] for f in pushdown if f["operator"] == "="):
+            return None
+        if "topics" in projection and (paged or
+                any(f["field"] == "topics" for f in residual)):
+            return None
+        return sorted(projection)
+
+
+    def _mergeProjectedTopics(self, conferences):
+        """Merge projection rows of the same Conference, one per topic,
+        returning (conferences, dict of key -> topics)."""
+        merged = OrderedDict()
+        topics = {}
+        for conf in conferences:
+            if conf.key not in merged:
+                merged[conf.key] = conf
+                topics[conf.key] = []
+            topics[conf.key].extend(conf.topics)
+        return merged.values(), topics
+
+
+    def _copyConferencesToForms(self, conferences, fields=None, topics=None):
+        """Copy a list of Conferences to ConferenceForms, resolving the
+        organizer display names with one batched Profile lookup.
+        With fields, only those are copied (e.g. from projected entities).
+        """
+        if fields is not None:
+            topics = topics or {}
+            forms = [self._copyConferenceFieldsToForm(conf, fields,
+                                                      topics.get(conf.key))
+                     for conf in conferences]
+            if 'organizerDisplayName' in fields:
+                names = self._getLegacyOrganizerNames(conferences)
+                for conf, cf in zip(conferences, forms):
+                    if cf.organizerDisplayName is None:
+                        cf.organizerDisplayName = names.get(conf.organizerUserId)
+            if 'seatsAvailable' in fields:
+                self._setSeatsAvailable(forms, conferences)
+            return forms
+
+        names = self._getLegacyOrganizerNames(conferences)
+        forms = [self._copyConferenceToForm(conf, conf.organizerDisplayName or
+                                            names.get(conf.organizerUserId))
+                 for conf in conferences]
+        self._setSeatsAvailable(forms, conferences)
+        return forms
+
+
+    @staticmethod
+    def _getLegacyOrganizerNames(conferences):
+        """Return dict of user ID -> display name for the organizers of
+        Conferences written before organizerDisplayName was stored."""
+        # only those older entities need a Profile; dedupe their
+        # organizer keys and fetch them all at once
+        organisers = list(set(ndb.Key(Profile, conf.organizerUserId)
+                              for conf in conferences
+                              if conf.organizerDisplayName is None))
+        futures = ndb.get_multi_async(organisers)
+
+        # put display names in a dict for easier fetching
+        names = {}
+        for future in futures:
+            profile = future.get_result()
+            if profile:
+                names[profile.key.id()] = profile.displayName
+        return names
+
+
+    def _getCachedConferenceForms(self, websafeKeys):
+        """Return dict of websafe key -> ConferenceForm, served from the
+        per-instance cache, then memcache, then the datastore."""
+        payloads = {}
+        for wsck in websafeKeys:
+            payload = _conference_cache.get(wsck)
+            if payload:
+                payloads[wsck] = payload
+
+        # look up the rest in memcache with one RPC
+        missing = [wsck for wsck in set(websafeKeys) if wsck not in payloads]
+        if missing:
+            cached = memcache.get_multi(missing,
+                key_prefix=MEMCACHE_CONFERENCE_PREFIX)
+            for wsck, payload in cached.iteritems():
+                _conference_cache.set(wsck, payload)
+            payloads.update(cached)
+            missing = [wsck for wsck in missing if wsck not in cached]
+        hits = len(payloads)
+
+        # load the rest from the datastore and write them through
+        fresh = {}
+        if missing:
+            confs = ndb.get_multi([ndb.Key(urlsafe=wsck) for wsck in missing])
+            found = [(wsck, conf) for wsck, conf in zip(missing, confs) if conf]
+            forms = self._copyConferencesToForms([conf for _, conf in found])
+            for (wsck, _), cf in zip(found, forms):
+                fresh[wsck] = protojson.encode_message(cf)
+                _conference_cache.set(wsck, fresh[wsck])
+            memcache.set_multi(fresh, key_prefix=MEMCACHE_CONFERENCE_PREFIX,
+                time=CONFERENCE_CACHE_TTL)
+            payloads.update(fresh)
+
+        self._recordConferenceCacheStats(hits, len(missing))
+        forms = {wsck: protojson.decode_message(ConferenceForm, payload)
+                 for wsck, payload in payloads.iteritems()}
+        # seat counts change too often to cache with the rest of the form
+        self._setSeatsAvailable([forms[wsck] for wsck in forms
+                                 if wsck not in fresh])
+        return forms
+
+
+    @staticmethod
+    def _invalidateConferenceCache(websafeKeys):
+        """Drop Conferences from the read cache and cached queryConferences
+        responses once the current transaction (if any) commits."""
+        def _invalidate():
+            for wsck in websafeKeys:
+                _conference_cache.delete(wsck)
+            memcache.delete_multi(websafeKeys,
+                key_prefix=MEMCACHE_CONFERENCE_PREFIX)
+            ConferenceApi._conferencesChanged()
+        ndb.get_context().call_on_commit(_invalidate)
+
+
+    @staticmethod
+    def _conferencesChanged():
+        """Bump the Conference generation now, and again once queries are
+        expected to see the change, since responses cached in between
+        may miss it; one delayed bump covers all changes in a window."""
+        ConferenceApi._bumpConferenceGeneration()
+        window = int(time.time() / QUERY_INDEX_DELAY)
+        ConferenceApi._addNamedTask('generation-%d' % window,
+            url='/tasks/bump_conference_generation',
+            countdown=(window + 2) * QUERY_INDEX_DELAY - time.time())
+
+
+    @staticmethod
+    def _bumpConferenceGeneration(delta=1):
+        """Increment & return the Conference generation that cached
+        queryConferences responses are keyed by; starts from the current
+        time so an evicted counter never reuses an old generation."""
+        return memcache.incr(MEMCACHE_CONFERENCE_GENERATION_KEY, delta=delta,
+                             initial_value=int(time.time()))
+
+
+    @staticmethod
+    def _seatShardKey(c_key, index):
+        """Return key of the index'th SeatShard of a Conference."""
+        return ndb.Key(SeatShard, '%s-%d' % (c_key.urlsafe(), index))
+
+
+    @staticmethod
+    def _makeSeatShards(conf, count=NUM_SEAT_SHARDS):
+        """Split conf.seatsAvailable across count new SeatShards."""
+        conf.seatShards = count
+        seats, extra = divmod(conf.seatsAvailable or 0, count)
+        return [SeatShard(key=ConferenceApi._seatShardKey(conf.key, i),
+                          conference=conf.key,
+                          seatsAvailable=seats + (1 if i < extra else 0))
+                for i in range(count)]
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _createSeatShards(c_key):
+        """Create SeatShards for a Conference written before seats were
+        sharded; returns the Conference."""
+        conf = c_key.get()
+        if not conf.seatShards:
+            ndb.put_multi(ConferenceApi._makeSeatShards(conf) + [conf])
+        return conf
+
+
+    @staticmethod
+    def _getSeatsAvailable(c_keys, confs=()):
+        """Return dict of websafe key -> seats available, summed from the
+        Conference SeatShards and cached in memcache. Conferences the
+        caller already holds can be given in confs, so they aren't loaded
+        again."""
+        wscks = [c_key.urlsafe() for c_key in c_keys]
+        seats = memcache.get_multi(wscks, key_prefix=MEMCACHE_SEATS_PREFIX)
+        missing = [c_key for c_key, wsck in zip(c_keys, wscks)
+                   if wsck not in seats]
+        if not missing:
+            return seats
+
+        # load the Conferences not given in one batch; projected ones
+        # don't carry the seat properties
+        held = {conf.key: conf for conf in confs
+                if conf and not conf._projection}
+        unheld = [c_key for c_key in missing if c_key not in held]
+        if unheld:
+            held.update((conf.key, conf) for conf in ndb.get_multi(unheld)
+                        if conf)
+        confs = [held[c_key] for c_key in missing if c_key in held]
+
+        # fetch the shards of all of them in one batch & sum them up;
+        # unsharded Conferences still hold the count. Totals are cached
+        # above, so going through ndb's memcache would only split the
+        # batch into many small Get RPCs
+        shards = iter(ndb.get_multi(
+            [ConferenceApi._seatShardKey(conf.key, i)
+             for conf in confs for i in range(conf.seatShards or 0)],
+            use_memcache=False))
+        fresh = {}
+        for conf in confs:
+            if conf.seatShards:
+                total = sum(shard.seatsAvailable for shard in
+                            [next(shards) for _ in range(conf.seatShards)]
+                            if shard)
+            else:
+                total = conf.seatsAvailable
+            fresh[conf.key.urlsafe()] = total or 0
+        memcache.add_multi(fresh, key_prefix=MEMCACHE_SEATS_PREFIX,
+            time=SEATS_CACHE_TTL)
+        seats.update(fresh)
+        return seats
+
+
+    def _setSeatsAvailable(self, forms, confs=()):
+        """Fill ConferenceForm.seatsAvailable from the seat counters;
+        confs are the Conferences of the forms, if at hand."""
+        if not forms:
+            return
+        seats = self._getSeatsAvailable(
+            [ndb.Key(urlsafe=cf.websafeKey) for cf in forms], confs)
+        for cf in forms:
+            if cf.websafeKey in seats:
+                cf.seatsAvailable = seats[cf.websafeKey]
+
+
+    @staticmethod
+    def _recordConferenceCacheStats(hits, misses):
+        """Count conference cache hits/misses, flushing them to memcache
+        every CONFERENCE_CACHE_STATS_FLUSH lookups."""
+        with _conference_cache_stats_lock:
+            _conference_cache_stats['hits'] += hits
+            _conference_cache_stats['misses'] += misses
+            if sum(_conference_cache_stats.values()) < CONFERENCE_CACHE_STATS_FLUSH:
+                return
+            offsets = dict(_conference_cache_stats)
+            _conference_cache_stats['hits'] = _conference_cache_stats['misses'] = 0
+        memcache.offset_multi(offsets,
+            key_prefix=MEMCACHE_CONFERENCE_STATS_PREFIX, initial_value=0)
+
+
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
         # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user = self._getCurrentUser()
+        user_id = self._getCurrentUserId()
 
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
@@ -148,7 +666,6 @@ class ConferenceApi(remote.Service):
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
-        del data['organizerDisplayName']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -176,54 +693,69 @@ class ConferenceApi(remote.Service):
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
-        return request
+        # store the organizer's display name on the Conference so reads
+        # don't need a Profile lookup; kept in sync by _doProfile()
+        prof = p_key.get()
+        data['organizerDisplayName'] = request.organizerDisplayName = \
+            getattr(prof, 'displayName', None) or user.nickname()
 
+        # create Conference with its seat shards, send email to organizer
+        # confirming creation of Conference & return (modified) ConferenceForm;
+        # the email is only queued if the Conference write commits
+        conf = Conference(**data)
 
-    @ndb.transactional()
-    def _updateConferenceObject(self, request):
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        @ndb.transactional(xg=True)
+        def _put():
+            ndb.put_multi(self._makeSeatShards(conf) + [conf])
+            self._queueConfirmationEmails([(user.email(), conf)])
 
-        # copy ConferenceForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
+        _put()
+        self._conferencesChanged()
+        return request
 
-        # update existing conference
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        # check that conference exists
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
-
-        # check that user is owner
-        if user_id != conf.organizerUserId:
-            raise endpoints.ForbiddenException(
-                'Only the owner can update the conference.')
-
-        # Not getting all the fields, so don't create a new object; just
-        # copy relevant fields from ConferenceForm to Conference object
-        for field in request.all_fields():
-            data = getattr(request, field.name)
-            # only copy fields where we get data
-            if data not in (None, []):
-                # special handling for dates (convert string to Date)
-                if field.name in ('startDate', 'endDate'):
-                    data = datetime.strptime(data, "%Y-%m-%d").date()
-                    if field.name == 'startDate':
-                        conf.month = data.month
-                # write to Conference object
-                setattr(conf, field.name, data)
-        conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+
+    def _updateConferenceObject(self, request):
+        user_id = self._getCurrentUserId()
+
+        # the Conference is updated in its own entity group; the form is
+        # built once committed, as the seat counts live in other groups
+        @ndb.transactional()
+        def _put():
+            # update existing conference
+            conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+            # check that conference exists
+            if not conf:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % request.websafeConferenceKey)
+
+            # check that user is owner
+            if user_id != conf.organizerUserId:
+                raise endpoints.ForbiddenException(
+                    'Only the owner can update the conference.')
+
+            # Not getting all the fields, so don't create a new object; just
+            # copy relevant fields from ConferenceForm to Conference object
+            for field in request.all_fields():
+                # organizer name is maintained from the Profile and seats
+                # from the SeatShards, not the form
+                if field.name in ('organizerDisplayName', 'seatsAvailable',
+                                  'websafeConferenceKey'):
+                    continue
+                data = getattr(request, field.name)
+                # only copy fields where we get data
+                if data not in (None, []):
+                    # special handling for dates (convert string to Date)
+                    if field.name in ('startDate', 'endDate'):
+                        data = datetime.strptime(data, "%Y-%m-%d").date()
+                        if field.name == 'startDate':
+                            conf.month = data.month
+                    # write to Conference object
+                    setattr(conf, field.name, data)
+            conf.put()
+            self._invalidateConferenceCache([request.websafeConferenceKey])
+            return conf
+
+        return self._copyConferencesToForms([_put()])[0]
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
@@ -246,60 +778,137 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
+        # get ConferenceForm from the read cache; bail if not found
+        wsck = request.websafeConferenceKey
+        cf = self._getCachedConferenceForms([wsck]).get(wsck)
+        if not cf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+                'No conference found with key: %s' % wsck)
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return cf
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_FIELDS_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
-
-        # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        user_id = self._getCurrentUserId()
+
+        # create ancestor query for all key matches for this user;
+        # with a fields selector try a projection query first
+        q = Conference.query(ancestor=ndb.Key(Profile, user_id))
+        fields = self._checkFields(request.fields)
+        projection = self._getProjection(fields)
+        topics = None
+        try:
+            confs = q.fetch(projection=projection)
+        except datastore_errors.NeedIndexError:
+            projection = None
+            confs = q.fetch()
+        if projection and 'topics' in projection:
+            confs, topics = self._mergeProjectedTopics(confs)
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
-        )
+        return ConferenceForms(items=self._copyConferencesToForms(confs, fields, topics))
+
+
+    def _planQuery(self, request):
+        """Return query plans for the submitted filters, best first.
 
+        Each plan is a dict of the filters pushed down to the datastore,
+        the inequality field they sort on and the residual filters that
+        are evaluated in memory. The datastore only allows inequalities on
+        one field, so filters on other inequality fields always become
+        residual. Later plans push down less in case the datastore has no
+        composite index for an earlier one; the last plan needs none.
+        """
+        filters = self._formatFilters(request.filters)
+        equalities = [f for f in filters if f["operator"] == "="]
+
+        # push down the inequality field with the tightest range; "!="
+        # counts for less as the datastore runs it as two range scans
+        scores = {}
+        for f in filters:
+            if f["operator"] != "=":
+                scores[f["field"]] = scores.get(f["field"], 0) + \
+                    (1 if f["operator"] != "!=" else 0.5)
+        inequality_field = None
+        if scores:
+            inequality_field = max(scores, key=lambda field: (
+                scores[field], -INEQUALITY_PREFERENCE.index(field)))
+
+        def plan(pushdown, inequality):
+            return {
+                "pushdown": pushdown,
+                "inequality": inequality,
+                "residual": [f for f in filters if f not in pushdown],
+            }
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
+        plans = [plan(equalities + [f for f in filters if f["operator"] != "="
+                                    and f["field"] == inequality_field],
+                      inequality_field)]
+        if inequality_field:
+            plans.append(plan(equalities, None))
+        if equalities:
+            plans.append(plan([], None))
+        return plans
+
+
+    def _explainPlan(self, plan, skipped=0, projection=None):
+        """Return a readable description of a query plan."""
+        def describe(filters):
+            return ", ".join("%s %s %s" % (f["field"], f["operator"], f["value"])
+                             for f in filters) or "none"
+        order = [plan["inequality"], "name"] if plan["inequality"] else ["name"]
+        explain = "datastore: %s order by %s; in memory: %s" % (
+            describe(plan["pushdown"]), ", ".join(order),
+            describe(plan["residual"]))
+        if projection:
+            explain += "; projection: %s" % ", ".join(projection)
+        if skipped:
+            explain += " (%d plan(s) skipped for missing indexes)" % skipped
+        return explain
+
+
+    def _getQuery(self, plan):
+        """Return formatted query from a query plan."""
         q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
 
         # If exists, sort on inequality filter first
-        if not inequality_filter:
+        if not plan["inequality"]:
             q = q.order(Conference.name)
         else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
+            q = q.order(ndb.GenericProperty(plan["inequality"]))
             q = q.order(Conference.name)
+        # names aren't unique, so cursors need the key to resume at; ndb
+        # also only pages through "!=" (run as several queries) with it.
+        # Indexes end in ascending key order, so this needs none
+        q = q.order(Conference.key)
 
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
+        for filtr in plan["pushdown"]:
             formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
         return q
 
 
+    def _matchesFilters(self, conf, filters):
+        """Return True if conf satisfies all (residual) filters."""
+        for filtr in filters:
+            values = getattr(conf, filtr["field"])
+            if not isinstance(values, list):
+                values = [values]
+            # like the datastore, a repeated property matches if any value does
+            compare = COMPARATORS[filtr["operator"]]
+            if not any(value is not None and compare(value, filtr["value"])
+                       for value in values):
+                return False
+        return True
+
+
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
@@ -310,18 +919,38 @@ class ConferenceApi(remote.Service):
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter on %s requires a number." % filtr["field"])
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
+
+
+    def _fetchConferences(self, q, request, projection=None):
+        """Run q once, returning (conferences, nextPageToken); when a
+        pageSize is given, page through the results with a datastore
+        cursor instead of fetching all."""
+        if not request.pageSize:
+            return q.fetch(projection=projection), None
+
+        if request.pageSize < 0:
+            raise endpoints.BadRequestException("'pageSize' must be positive.")
+        cursor = None
+        if request.pageToken:
+            try:
+                cursor = Cursor(urlsafe=request.pageToken)
+            except datastore_errors.BadValueError:
+                raise endpoints.BadRequestException("Invalid 'pageToken'.")
+        conferences, next_cursor, more = q.fetch_page(
+            min(request.pageSize, MAX_PAGE_SIZE), start_cursor=cursor,
+            projection=projection)
+        if more and next_cursor:
+            return conferences, next_cursor.urlsafe()
+        return conferences, None
 
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
@@ -330,87 +959,191 @@ class ConferenceApi(remote.Service):
             name='queryConferences')
     def queryConferences(self, request):
         """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        # responses don't depend on the user, so they are cached for
+        # everyone under the current generation & normalized request
+        generation = self._bumpConferenceGeneration(delta=0)
+        cache_key = None
+        if generation is not None:
+            cache_key = '%s%d:%s' % (MEMCACHE_QUERY_PREFIX, generation,
+                                     self._queryConferencesHash(request))
+            payload = memcache.get(cache_key)
+            if payload:
+                response = protojson.decode_message(ConferenceForms, payload)
+                # seat counts change too often to cache with the response
+                if not request.fields or 'seatsAvailable' in request.fields:
+                    self._setSeatsAvailable(response.items)
+                return response
+
+        response = self._queryConferences(request)
+        if cache_key:
+            memcache.set(cache_key, protojson.encode_message(response),
+                time=QUERY_CACHE_TTL)
+        return response
+
+
+    def _queryConferencesHash(self, request):
+        """Return canonical hash of the normalized queryConferences request."""
+        filters = sorted((f["field"], f["operator"], f["value"])
+                         for f in self._formatFilters(request.filters))
+        canonical = json.dumps({
+            'filters': filters,
+            'pageSize': min(request.pageSize, MAX_PAGE_SIZE) if request.pageSize else None,
+            'pageToken': request.pageToken,
+            'fields': sorted(set(request.fields)),
+            'debug': bool(request.debug),
+        }, sort_keys=True)
+        return hashlib.sha1(canonical).hexdigest()
+
+
+    def _queryConferences(self, request):
+        """Run queryConferences against the datastore."""
+        # run the best plan the datastore has indexes for; with a fields
+        # selector try each plan as a projection query first
+        fields = self._checkFields(request.fields)
+        attempts = []
+        for plan in self._planQuery(request):
+            projection = self._getProjection(fields, plan, bool(request.pageSize))
+            if projection:
+                attempts.append((plan, projection))
+            attempts.append((plan, None))
+        for skipped, (plan, projection) in enumerate(attempts):
+            try:
+                conferences, next_page_token = self._fetchConferences(
+                    self._getQuery(plan), request, projection)
+                break
+            except datastore_errors.NeedIndexError:
+                if skipped == len(attempts) - 1:
+                    raise
+                logging.warning('No index for %s',
+                                self._explainPlan(plan, projection=projection))
+
+        topics = None
+        if projection and 'topics' in projection:
+            conferences, topics = self._mergeProjectedTopics(conferences)
+
+        # filters the datastore couldn't take are applied in memory;
+        # pages may then hold fewer than pageSize conferences
+        if plan["residual"]:
+            conferences = [conf for conf in conferences
+                           if self._matchesFilters(conf, plan["residual"])]
 
         # return individual ConferenceForm object per Conference
         return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
+                items=self._copyConferencesToForms(conferences, fields, topics),
+                nextPageToken=next_page_token,
+                explain=self._explainPlan(plan, skipped, projection) if request.debug else None
         )
 
 # - - - Session objects - - - - - - - - - - - - - - - - -
     def _copySessionToForm(self, sess):
         """Copy relevant fields from Session to SessionForm."""
         cf = SessionForm()
-        for field in cf.all_fields():
-            if hasattr(sess, field.name):
-                if field.name.endswith('Time') or field.name.endswith('date'):
-                    setattr(cf, field.name, str(getattr(sess, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(sess, field.name))
+        _copyFields(SESSION_COPIER, sess, cf)
         cf.check_initialized()
         return cf
 
-    def _createSessionObject(self, request):
-        """Create Session object, returning SessionForm/request."""
+    def _createSessionObjects(self, requests):
+        """Create Session objects, returning SessionForms/requests."""
         # check auth
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-
-        # copy SessionForm into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-        user_id = getUserId(user)
-        conf = ndb.Key(urlsafe=data['confwebsafeKey']).get()
-
-        if not request.name:
-            raise endpoints.BadRequestException("Session 'name' field required")
-
-
-        # add default values for those missing (both data model & outbound Message)
-        for df in S_DEFAULTS:
-            if data[df] in (None, []):
-                data[df] = S_DEFAULTS[df]
-                setattr(request, df, S_DEFAULTS[df])
-
-        # add date and time
-        if data['startTime']:
-            data['startTime'] = datetime.strptime(data['startTime'], "%H:%M").time()
-        if data['date']:
-            data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
-
-        # generate session key from conference key
-        p_key = conf.key
-        c_id = Session.allocate_ids(size=1, parent=p_key)[0]
-        c_key = ndb.Key(Session, c_id, parent=p_key)
-        data['key'] = c_key
-        if not data['speaker']:
-            data['speaker'] = user.nickname()
-        del data['confwebsafeKey']
+        user = self._getCurrentUser()
+
+        # copy each SessionForm into dict, grouped by conference
+        by_conf = OrderedDict()
+        for request in requests:
+            data = {field.name: getattr(request, field.name) for field in request.all_fields()}
+
+            if not request.name:
+                raise endpoints.BadRequestException("Session 'name' field required")
+            if not request.confwebsafeKey:
+                raise endpoints.BadRequestException("Session 'confwebsafeKey' field required")
+
+            # add default values for those missing (both data model & outbound Message)
+            for df in S_DEFAULTS:
+                if data[df] in (None, []):
+                    data[df] = S_DEFAULTS[df]
+                    setattr(request, df, S_DEFAULTS[df])
+
+            # add date and time
+            if data['startTime']:
+                data['startTime'] = datetime.strptime(data['startTime'], "%H:%M").time()
+            if data['date']:
+                data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
+
+            if not data['speaker']:
+                data['speaker'] = user.nickname()
+            by_conf.setdefault(data.pop('confwebsafeKey'), []).append(data)
+
+        # check that all conferences exist
+        c_keys = [ndb.Key(urlsafe=wsck) for wsck in by_conf]
+        for wsck, conf in zip(by_conf, ndb.get_multi(c_keys)):
+            if not conf:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % wsck)
+
+        for c_key, datas in zip(c_keys, by_conf.values()):
+            self._putSessions(c_key, datas)
+        return requests
 
-        # if speaker has more than 1 session, add to featured speaker memcache
-        q = Session.query().filter(Session.speaker == data['speaker']).count()
-        if q > 1:
-            taskqueue.add(params={'speaker': data['speaker']}, url='/tasks/set_featured_speaker')
 
-        Session(**data).put()
-        return request
+    @staticmethod
+    def _putSessions(c_key, datas):
+        """Write Sessions of one Conference along with their Speakers.
+        Sessions in datas that already have a key are skipped if they
+        exist, so imports can be replayed."""
+        # generate missing session keys from conference key in one call
+        new = [data for data in datas if 'key' not in data]
+        existing = len(new) < len(datas)
+        if new:
+            first, last = Session.allocate_ids(size=len(new), parent=c_key)
+            for data, s_id in zip(new, range(first, last + 1)):
+                data['key'] = ndb.Key(Session, s_id, parent=c_key)
+
+        # Speakers are in the Conference entity group with the Sessions,
+        # so each chunk is written in one transaction; if a speaker has
+        # more than 1 session, the conference's featured speaker is rebuilt
+        # by a task enqueued with the first chunk that commits one
+        @ndb.transactional()
+        def _put(chunk, queued):
+            if existing:
+                chunk = [data for data, sess in
+                         zip(chunk, ndb.get_multi([d['key'] for d in chunk]))
+                         if not sess]
+            names = list(OrderedDict.fromkeys(data['speaker'] for data in chunk
+                                              if data['speaker']))
+            sp_keys = [ndb.Key(Speaker, name, parent=c_key) for name in names]
+            speakers = {}
+            for sp_key, name, speaker in zip(sp_keys, names, ndb.get_multi(sp_keys)):
+                speakers[name] = speaker or Speaker(key=sp_key, name=name)
+            for data in chunk:
+                if not data['speaker']:
+                    continue
+                speaker = speakers[data['speaker']]
+                speaker.sessionKeys.append(data['key'])
+                speaker.sessionCount += 1
+            ndb.put_multi([Session(**data) for data in chunk] + speakers.values())
+            if queued or not any(speaker.sessionCount > 1
+                                 for speaker in speakers.values()):
+                return queued
+            taskqueue.add(params={'websafeConferenceKey': c_key.urlsafe()},
+                url='/tasks/set_featured_speaker', transactional=True)
+            return True
+
+        queued = False
+        for i in range(0, len(datas), SESSION_PUT_BATCH_SIZE):
+            queued = _put(datas[i:i + SESSION_PUT_BATCH_SIZE], queued)
+        memcache.delete(MEMCACHE_TIMETABLE_PREFIX + c_key.urlsafe())
 
     @endpoints.method(SessionForm, SessionForm, path='session',
             http_method='POST', name='createSession')
     def createSession(self, request):
         """Create new session."""
-        return self._createSessionObject(request)
+        return self._createSessionObjects([request])[0]
+
+    @endpoints.method(SessionForms, SessionForms, path='sessions',
+            http_method='POST', name='createSessions')
+    def createSessions(self, request):
+        """Create new sessions in one batch."""
+        return SessionForms(items=self._createSessionObjects(request.items))
 
     @endpoints.method(SessionQuerySpeaker, SessionForms, path='querySpeaker',
             http_method='GET', name='getSessionBySpeaker')
@@ -450,6 +1183,107 @@ class ConferenceApi(remote.Service):
         q = Session.query(ancestor=conf.key).fetch()
         return SessionForms(items=[self._copySessionToForm(sess) for sess in q])
 
+    def _getSessionTimetable(self, wsck):
+        """Return the Conference's session timetable from memcache,
+        building it from an ancestor query if missing.
+
+        The timetable holds the session types (bit i of a type mask is
+        types[i]), the sorted start times in minutes (-1 if not set) and
+        per session a (typeMask, speaker, date, SessionForm payload) tuple.
+        """
+        timetable = memcache.get(MEMCACHE_TIMETABLE_PREFIX + wsck)
+        if timetable is not None:
+            return timetable
+
+        c_key = ndb.Key(urlsafe=wsck)
+        sessions = Session.query(ancestor=c_key).fetch()
+        types = sorted(set(t for sess in sessions for t in sess.typeOfSession))
+        bits = {t: 1 << i for i, t in enumerate(types)}
+
+        rows = []
+        for sess in sessions:
+            start = (sess.startTime.hour * 60 + sess.startTime.minute
+                     if sess.startTime is not None else -1)
+            mask = 0
+            for t in sess.typeOfSession:
+                mask |= bits[t]
+            rows.append((start, mask, sess.speaker, str(sess.date),
+                         protojson.encode_message(self._copySessionToForm(sess))))
+        rows.sort(key=lambda row: row[0])
+
+        timetable = {
+            'types': types,
+            'starts': [row[0] for row in rows],
+            'sessions': [row[1:] for row in rows],
+        }
+        memcache.set(MEMCACHE_TIMETABLE_PREFIX + wsck, timetable,
+            time=TIMETABLE_CACHE_TTL)
+        return timetable
+
+
+    def _searchSessions(self, wsck, startTimeFrom=None, startTimeTo=None,
+                        includeTypes=(), excludeTypes=(), speaker=None,
+                        date=None):
+        """Return SessionForms matching all the given filters, using the
+        Conference's cached timetable."""
+        timetable = self._getSessionTimetable(wsck)
+        starts = timetable['starts']
+        bits = {t: 1 << i for i, t in enumerate(timetable['types'])}
+
+        # narrow down to the start time range by bisecting; sessions with
+        # no start time only match when no time range is given. Midnight
+        # is a false time, so check against None
+        lo, hi = 0, len(starts)
+        if startTimeFrom is not None or startTimeTo is not None:
+            lo = bisect_left(starts, 0)
+        if startTimeFrom is not None:
+            lo = max(lo, bisect_left(starts, startTimeFrom.hour * 60 + startTimeFrom.minute))
+        if startTimeTo is not None:
+            hi = bisect_right(starts, startTimeTo.hour * 60 + startTimeTo.minute)
+
+        include = 0
+        for t in includeTypes:
+            include |= bits.get(t, 0)
+        exclude = 0
+        for t in excludeTypes:
+            exclude |= bits.get(t, 0)
+
+        items = []
+        for mask, sess_speaker, sess_date, payload in timetable['sessions'][lo:hi]:
+            if includeTypes and not mask & include:
+                continue
+            if mask & exclude:
+                continue
+            if speaker and sess_speaker != speaker:
+                continue
+            if date and sess_date != date:
+                continue
+            items.append(protojson.decode_message(SessionForm, payload))
+        return SessionForms(items=items)
+
+
+    @endpoints.method(SessionSearchForm, SessionForms, path='sessionSearch',
+            http_method='GET', name='searchSessions')
+    def searchSessions(self, request):
+        """Search conference sessions by start time range, types, speaker
+        and date."""
+        if not request.websafeConferenceKey:
+            raise endpoints.ForbiddenException('Requires websafeConferenceKey.')
+
+        try:
+            times = [datetime.strptime(t, "%H:%M").time() if t else None
+                     for t in (request.startTimeFrom, request.startTimeTo)]
+        except ValueError:
+            raise endpoints.BadRequestException("Start times must be 'HH:MM'.")
+
+        return self._searchSessions(request.websafeConferenceKey,
+            startTimeFrom=times[0], startTimeTo=times[1],
+            includeTypes=request.includeTypes,
+            excludeTypes=request.excludeTypes,
+            speaker=request.speaker,
+            date=request.date[:10] if request.date else None)
+
+
     @endpoints.method(SessionQuery, SessionForms, path='sessionProblemQuery',
             http_method='GET', name='getConferenceSessionsProblem')
     def getConferenceSessionsProblem(self, request):
@@ -457,17 +1291,10 @@ class ConferenceApi(remote.Service):
         if not request.websafeConferenceKey:
             raise endpoints.ForbiddenException('Requires websafeConferenceKey.')
 
+        # sessions up to 7pm that aren't workshops
         this_time = datetime.strptime('19:00:00', "%H:%M:%S").time()
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        q = Session.query(ancestor=conf.key).\
-            filter(Session.startTime <= this_time)
-
-        a = []
-        for i in q:
-            if "Workshop" not in i.typeOfSession:
-                a.append(i)
-
-        return SessionForms(items=[self._copySessionToForm(sess) for sess in a])
+        return self._searchSessions(request.websafeConferenceKey,
+            startTimeTo=this_time, excludeTypes=['Workshop'])
 
 
 # - - - Wishlist - - - - - - - - - - - - - - - - - - - -
@@ -476,7 +1303,7 @@ class ConferenceApi(remote.Service):
         """Copy relevant fields from Wishlist to WishlistForm."""
         wf = WishlistForm()
         wf.sessionName = wish.sessionName
-        wf.sessionKey = str(wish.sessionKey)
+        wf.sessionKey = wish.sessionKey.urlsafe()
         wf.typeOfSession = wish.typeOfSession
         wf.check_initialized()
         return wf
@@ -485,39 +1312,41 @@ class ConferenceApi(remote.Service):
         """Create or update Wishlist object, returning WishlistForm/request."""
 
         # check auth
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        # check sessionName exists
-        if not request.sessionName:
-            raise endpoints.UnauthorizedException('Name required')
-        # get userId
-        user_id = getUserId(user)
-
-        # get session key
-        this_session = Session.query(Session.name == request.sessionName).get()
+        user_id = self._getCurrentUserId()
+        # check sessionKey or sessionName exists
+        if not (request.sessionKey or request.sessionName):
+            raise endpoints.UnauthorizedException('Session key or name required')
+
+        # get session by websafe key; fall back to looking it up by name
+        if request.sessionKey:
+            this_session = self._keyOrNotFound(request.sessionKey, 'Session',
+                'No session found with key: %s' % request.sessionKey).get()
+        else:
+            this_session = Session.query(Session.name == request.sessionName).get()
+        if not this_session:
+            raise endpoints.NotFoundException('No session found')
 
         # populate dict
-        data = {'userId': user_id, 'sessionName': request.sessionName, 'sessionKey': this_session.key,
+        data = {'userId': user_id, 'sessionName': this_session.name, 'sessionKey': this_session.key,
                 'typeOfSession': this_session.typeOfSession}
 
-        # generate wishlist key from session key
-        p_key = this_session.key
-        c_id = Wishlist.allocate_ids(size=1, parent=p_key)[0]
-        c_key = ndb.Key(Wishlist, c_id, parent=p_key)
-        data['key'] = c_key
-
-        # query wishlist, filter by userId and sessionName, then count
-        q = Wishlist.query()
-        q = q.filter(Wishlist.userId == user_id)
+        # wishlist key is derived from user and session, so each session
+        # can only be in a user's wishlist once
+        data['key'] = ndb.Key(Wishlist, this_session.key.urlsafe(),
+                              parent=ndb.Key(Profile, user_id))
 
-        # if this session already in user's wishlist, bounce
-        for i in q:
-            if i.sessionKey == this_session.key:
+        @ndb.transactional()
+        def _add():
+            # if this session already in user's wishlist, bounce
+            if data['key'].get():
                 raise endpoints.UnauthorizedException('Session already added to wishlist')
+            # save to wishlist
+            Wishlist(**data).put()
+        _add()
 
-        # save to wishlist
-        Wishlist(**data).put()
+        request.sessionName = this_session.name
+        request.sessionKey = this_session.key.urlsafe()
+        request.typeOfSession = this_session.typeOfSession
         return request
 
     @endpoints.method(WishlistForm, WishlistForm, path='wishlist',
@@ -532,13 +1361,10 @@ class ConferenceApi(remote.Service):
         """Get sessions in wishlist."""
 
         # check auth
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        # get userId
-        user_id = getUserId(user)
-        # query wishlist, filter by userId
-        q = Wishlist.query().filter(Wishlist.userId == user_id)
+        user_id = self._getCurrentUserId()
+        # the user's wishlist is their Profile's entity group, so an
+        # ancestor query sees entries just added
+        q = Wishlist.query(ancestor=ndb.Key(Profile, user_id))
 
         return WishlistForms(items=[self._copyWishlistToForm(wish) for wish in q])
 
@@ -548,21 +1374,15 @@ class ConferenceApi(remote.Service):
         """Get wishlist by speaker."""
 
         # check auth
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        # get userId
-        user_id = getUserId(user)
-        # query session, filter by speaker
-        q = Session.query().filter(Session.speaker == request.speaker)
-        # query wishlist, filter by userId
-        p = Wishlist.query().filter(Wishlist.userId == user_id)
+        user_id = self._getCurrentUserId()
+        # query session keys, filter by speaker, and query the user's
+        # wishlist; both queries run concurrently
+        q = Session.query().filter(Session.speaker == request.speaker).fetch_async(keys_only=True)
+        p = Wishlist.query(ancestor=ndb.Key(Profile, user_id)).fetch_async()
 
-        a = []
-        for s in q:
-            for w in p:
-                if s.key == w.sessionKey:
-                    a.append(w)
+        # join the two on session key
+        speaker_keys = set(q.get_result())
+        a = [w for w in p.get_result() if w.sessionKey in speaker_keys]
 
         return WishlistForms(items=[self._copyWishlistToForm(wish) for wish in a])
 
@@ -572,14 +1392,9 @@ class ConferenceApi(remote.Service):
         """Get wishlist by type."""
 
         # check auth
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        # get userId
-        user_id = getUserId(user)
-        # query wishlist, filter by userId and typeOfSession
-        q = Wishlist.query()
-        q = q.filter(Wishlist.userId == user_id)
+        user_id = self._getCurrentUserId()
+        # query the user's wishlist, filter by typeOfSession
+        q = Wishlist.query(ancestor=ndb.Key(Profile, user_id))
         q = q.filter(Wishlist.typeOfSession == request.typeOfSession)
 
         return WishlistForms(items=[self._copyWishlistToForm(wish) for wish in q])
@@ -588,28 +1403,48 @@ class ConferenceApi(remote.Service):
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
+        # copy relevant fields from Profile to ProfileForm; t-shirt
+        # string becomes an Enum, conference keys websafe strings
         pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
+        _copyFields(PROFILE_COPIER, prof, pf)
         pf.check_initialized()
         return pf
 
 
+    # ConferenceApi is instantiated per request, so these memos are
+    # request scoped
+    _currentUser = None
+    _currentUserId = None
+    _currentProfile = None
+
+    def _getCurrentUser(self):
+        """Return the current user, resolved once per request."""
+        if self._currentUser is None:
+            user = endpoints.get_current_user()
+            if not user:
+                raise endpoints.UnauthorizedException('Authorization required')
+            self._currentUser = user
+        return self._currentUser
+
+
+    def _getCurrentUserId(self):
+        """Return ID of the current user, resolved once per request."""
+        if self._currentUserId is None:
+            self._currentUserId = getUserId(self._getCurrentUser())
+        return self._currentUserId
+
+
     def _getProfileFromUser(self):
-        """Return user Profile from datastore, creating new one if non-existent."""
+        """Return user Profile from datastore, creating new one if non-existent;
+        loaded once per request."""
+        if self._currentProfile is not None:
+            return self._currentProfile
+
         # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
+        user = self._getCurrentUser()
 
         # get Profile from datastore
-        user_id = getUserId(user)
+        user_id = self._getCurrentUserId()
         p_key = ndb.Key(Profile, user_id)
         profile = p_key.get()
         # create new Profile if not there
@@ -622,6 +1457,7 @@ class ConferenceApi(remote.Service):
             )
             profile.put()
 
+        self._currentProfile = profile
         return profile      # return Profile
 
 
@@ -629,9 +1465,11 @@ class ConferenceApi(remote.Service):
         """Get user Profile and return to user, possibly updating it first."""
         # get user Profile
         prof = self._getProfileFromUser()
+        displayName = prof.displayName
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            changed = False
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
@@ -641,7 +1479,20 @@ class ConferenceApi(remote.Service):
                         #    setattr(prof, field, str(val).upper())
                         #else:
                         #    setattr(prof, field, val)
-                        prof.put()
+                        changed = True
+
+            # rename the organizer on all of their conferences; the task
+            # is only enqueued if the Profile write commits
+            @ndb.transactional()
+            def _put(renamed):
+                prof.put()
+                if renamed:
+                    taskqueue.add(params={'userId': prof.key.id()},
+                        url='/tasks/update_organizer_name', transactional=True
+                    )
+
+            if changed:
+                _put(prof.displayName != displayName)
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
@@ -661,68 +1512,476 @@ class ConferenceApi(remote.Service):
         return self._doProfile(request)
 
 
+    @staticmethod
+    def _migrateConferenceKeysToAttend(websafeCursor=None):
+        """Convert a batch of Profiles from websafe conference strings to
+        keys; used by the migrate attendance task.
+        Returns the websafe cursor of the next batch, or None.
+        """
+        cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        p_keys, cursor, more = Profile.query().fetch_page(
+            MIGRATION_BATCH_SIZE, start_cursor=cursor, keys_only=True)
 
+        # Profile._post_get_hook converts on load, so writing the
+        # Profiles back stores keys only
+        @ndb.transactional(xg=True)
+        def _migrate():
+            ndb.put_multi([prof for prof in ndb.get_multi(p_keys) if prof])
+        _migrate()
+
+        if more and cursor:
+            return cursor.urlsafe()
+        return None
 
-# - - - MEMCACHE - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+    def _migrateSpeakers(websafeCursor=None):
+        """Rebuild the Speakers of a batch of Conferences from their
+        Sessions, for sessions written before Speakers were maintained;
+        used by the migrate speakers task.
+        Returns the websafe cursor of the next batch, or None.
+        """
+        cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        c_keys, cursor, more = Conference.query().fetch_page(
+            MIGRATION_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+        # the Sessions & Speakers of a Conference share its entity group,
+        # so each is rebuilt in one transaction and replays are harmless
+        @ndb.transactional()
+        def _migrate(c_key):
+            speakers = OrderedDict()
+            for sess in Session.query(ancestor=c_key):
+                if not sess.speaker:
+                    continue
+                speaker = speakers.get(sess.speaker)
+                if not speaker:
+                    speaker = speakers[sess.speaker] = Speaker(
+                        key=ndb.Key(Speaker, sess.speaker, parent=c_key),
+                        name=sess.speaker)
+                speaker.sessionKeys.append(sess.key)
+                speaker.sessionCount += 1
+            stale = [sp_key for sp_key in
+                     Speaker.query(ancestor=c_key).fetch(keys_only=True)
+                     if sp_key.id() not in speakers]
+            ndb.put_multi(speakers.values())
+            ndb.delete_multi(stale)
+
+        for c_key in c_keys:
+            _migrate(c_key)
+        memcache.delete_multi([c_key.urlsafe() for c_key in c_keys],
+                              key_prefix=MEMCACHE_FEATURED_PREFIX)
+
+        if more and cursor:
+            return cursor.urlsafe()
+        return None
+
+
+    @staticmethod
+    def _migrateWishlists(websafeCursor=None):
+        """Re-key a batch of Wishlist entries written as children of their
+        Session under their user's Profile, id'd by the websafe session
+        key; used by the migrate wishlists task. Entries for a session
+        already on the user's wishlist are dropped.
+        Returns the websafe cursor of the next batch, or None.
         """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
+        cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        w_keys, cursor, more = Wishlist.query().fetch_page(
+            MIGRATION_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+        # the old and new entry are in different entity groups
+        @ndb.transactional(xg=True)
+        def _migrate(w_key):
+            wish = w_key.get()
+            if not wish:
+                return
+            if wish.userId and wish.sessionKey:
+                new_key = ndb.Key(Wishlist, wish.sessionKey.urlsafe(),
+                                  parent=ndb.Key(Profile, wish.userId))
+                if not new_key.get():
+                    Wishlist(key=new_key, **wish.to_dict()).put()
+            w_key.delete()
+
+        for w_key in w_keys:
+            if w_key.parent() and w_key.parent().kind() == 'Session':
+                _migrate(w_key)
+
+        if more and cursor:
+            return cursor.urlsafe()
+        return None
+
+
+# - - - Tasks - - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _addNamedTask(name, **kwargs):
+        """Add a task named name, unless one was already added with that
+        name; duplicate requests and task retries add nothing."""
+        try:
+            taskqueue.add(name=name, **kwargs)
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
+
+
+    @staticmethod
+    def _addContinuationTask(taskName, **kwargs):
+        """Add the task continuing the work of task taskName, named after
+        it so a retried task adds nothing; unnamed if not run as a task."""
+        if not taskName:
+            taskqueue.add(**kwargs)
+            return
+        ConferenceApi._addNamedTask(
+            'next-' + hashlib.sha1(taskName).hexdigest(), **kwargs)
+
+
+# - - - Confirmation emails - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _conferenceSummary(conf):
+        """Return compact dict describing a Conference for emails."""
+        return {
+            'websafeKey': conf.key.urlsafe(),
+            'name': conf.name,
+            'city': conf.city,
+            'startDate': str(conf.startDate) if conf.startDate else None,
+            'endDate': str(conf.endDate) if conf.endDate else None,
+        }
+
+
+    @staticmethod
+    def _queueConfirmationEmails(confirmations):
+        """Queue confirmation emails for (email, Conference) pairs; either
+        recorded for the notifications cron or sent as one task per
+        recipient. Notifications are keyed by Conference, so replayed
+        imports don't notify twice."""
+        if CONFIRMATION_EMAIL_DIGEST:
+            ndb.put_multi([Notification(id=conf.key.urlsafe(), email=email,
+                conference=ConferenceApi._conferenceSummary(conf))
+                for email, conf in confirmations])
+            return
+
+        by_email = OrderedDict()
+        for email, conf in confirmations:
+            by_email.setdefault(email, []).append(
+                ConferenceApi._conferenceSummary(conf))
+        ConferenceApi._addConfirmationEmailTasks(by_email)
+
+
+    @staticmethod
+    def _addConfirmationEmailTasks(by_email):
+        """Add one send confirmation email task per recipient, with a JSON
+        payload of their Conferences; tasks are added 100 per call.
+        Within a transaction the tasks are transactional, otherwise they
+        are named after their Conferences so a replay adds nothing."""
+        transactional = ndb.in_transaction()
+        tasks = []
+        for email, confs in by_email.iteritems():
+            name = None
+            if not transactional:
+                name = 'confirm-' + hashlib.sha1(email + ''.join(
+                    conf['websafeKey'] for conf in confs)).hexdigest()
+            tasks.append(taskqueue.Task(url='/tasks/send_confirmation_email',
+                payload=json.dumps({'email': email, 'conferences': confs}),
+                name=name))
+        queue = taskqueue.Queue()
+        for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            try:
+                queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD],
+                          transactional=transactional)
+            except (taskqueue.TaskAlreadyExistsError,
+                    taskqueue.TombstonedTaskError):
+                pass
+
+
+    @staticmethod
+    def _sendNotificationDigests():
+        """Coalesce pending Notifications into one confirmation email per
+        recipient; used by the send notifications cron job.
+        Returns True if more Notifications may be pending.
+        """
+        notes = Notification.query().fetch(NOTIFICATION_BATCH_SIZE)
+        if not notes:
+            return False
+
+        by_email = OrderedDict()
+        for note in notes:
+            by_email.setdefault(note.email, []).append(note.conference)
+        ConferenceApi._addConfirmationEmailTasks(by_email)
+        ndb.delete_multi([note.key for note in notes])
+        return len(notes) == NOTIFICATION_BATCH_SIZE
+
+
+# - - - Import/Export - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _exportEntities(kind, websafeCursor=None):
+        """Return up to EXPORT_MAX_ENTITIES entities of kind as JSON-able
+        dicts, read page by page, and the websafe cursor to continue
+        from, or None when done."""
+        model = TRANSFER_KINDS[kind]
+        cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        records = []
+        more = True
+        while more and len(records) < EXPORT_MAX_ENTITIES:
+            entities, cursor, more = model.query().fetch_page(
+                EXPORT_BATCH_SIZE, start_cursor=cursor)
+            page = [_entityToJson(entity) for entity in entities]
+            if model is Conference:
+                # seats are kept by the SeatShards; export the total and
+                # let the importing side shard again
+                seats = ConferenceApi._getSeatsAvailable(
+                    [entity.key for entity in entities], entities)
+                for record in page:
+                    props = record['properties']
+                    props['seatsAvailable'] = seats.get(
+                        ndb.Key(flat=record['key']).urlsafe(),
+                        props['seatsAvailable'])
+                    props['seatShards'] = 0
+            records.extend(page)
+
+        if more and cursor:
+            return records, cursor.urlsafe()
+        return records, None
+
+
+    @staticmethod
+    def _importEntities(lines, notify=False):
+        """Write the Conferences & Sessions in newline-delimited JSON
+        lines made by _exportEntities(); used by the import task.
+        Confirmation emails are only sent if notify is set.
+        """
+        confs = []
+        sessions = OrderedDict()
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                entity = _entityFromJson(TRANSFER_KINDS[record['kind']], record)
+            except (ValueError, KeyError, TypeError) as e:
+                logging.warning('Skipping import line %r: %s', line[:100], e)
+                continue
+            if isinstance(entity, Conference):
+                entity.seatShards = 0
+                confs.append(entity)
+            else:
+                sessions.setdefault(entity.key.parent(), []).append(entity)
+
+        # keep the datastore from allocating the imported IDs again
+        ranges = {}
+        for entity in confs + [sess for group in sessions.values() for sess in group]:
+            if entity.key.integer_id():
+                group = (type(entity), entity.key.parent())
+                ranges[group] = max(ranges.get(group, 0), entity.key.integer_id())
+        for (model, parent), max_id in ranges.iteritems():
+            model.allocate_ids(max=max_id, parent=parent)
 
         if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL+str(time.ctime())
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+            ndb.put_multi(confs)
+            ConferenceApi._conferencesChanged()
+        for c_key, group in sessions.iteritems():
+            ConferenceApi._putSessions(c_key, [dict(sess.to_dict(), key=sess.key)
+                                               for sess in group])
+
+        # send email to organizers confirming creation of Conference
+        if notify and confs:
+            profiles = ndb.get_multi([conf.key.parent() for conf in confs])
+            ConferenceApi._queueConfirmationEmails(
+                [(prof.mainEmail, conf) for conf, prof in zip(confs, profiles)
+                 if prof and prof.mainEmail])
 
+
+    @staticmethod
+    def _updateOrganizerDisplayName(user_id, websafeCursor=None):
+        """Copy the organizer's displayName onto a batch of their
+        Conferences; used by the update organizer name task.
+        Returns the websafe cursor of the next batch, or None.
+        """
+        prof = ndb.Key(Profile, user_id).get()
+        if not prof:
+            return None
+
+        cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        c_keys, cursor, more = Conference.query(ancestor=prof.key).fetch_page(
+            ORGANIZER_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+        # conferences share the Profile entity group, so a batch can be
+        # rewritten in one transaction without clobbering seat changes
+        @ndb.transactional()
+        def _rename():
+            confs = [conf for conf in ndb.get_multi(c_keys)
+                     if conf and conf.organizerDisplayName != prof.displayName]
+            for conf in confs:
+                conf.organizerDisplayName = prof.displayName
+            ndb.put_multi(confs)
+            ConferenceApi._invalidateConferenceCache(
+                [conf.key.urlsafe() for conf in confs])
+        _rename()
+
+        if more and cursor:
+            return cursor.urlsafe()
+        return None
+
+
+
+
+# - - - MEMCACHE - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _formatAnnouncement(almost):
+        """Return Announcement listing almost sold out Conferences."""
+        if not almost:
+            return ""
+        return ANNOUNCEMENT_TPL % ', '.join(sorted(almost.values()))
+
+
+    @staticmethod
+    def _getAlmostSoldOut():
+        """Return dict of websafe key -> name of almost sold out
+        Conferences, from memcache or its backing entity."""
+        almost = memcache.get(MEMCACHE_ALMOST_SOLD_OUT_KEY)
+        if almost is None:
+            entity = ndb.Key(AlmostSoldOut, 'conferences').get()
+            almost = (entity and entity.conferences) or {}
+            memcache.add(MEMCACHE_ALMOST_SOLD_OUT_KEY, almost)
+        return almost
+
+
+    @staticmethod
+    def _almostSoldOutChanges(confs, almost):
+        """Return dict of websafe key -> name (or None to remove) for
+        Conferences whose almost sold out entry is out of date."""
+        seats = ConferenceApi._getSeatsAvailable([conf.key for conf in confs],
+                                                 confs)
+        changes = {}
+        for conf in confs:
+            wsck = conf.key.urlsafe()
+            left = seats.get(wsck, 0)
+            name = conf.name if 0 < left <= ALMOST_SOLD_OUT_SEATS else None
+            if name != almost.get(wsck):
+                changes[wsck] = name
+        return changes
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _putAlmostSoldOut(changes, reconcile=False, websafeCursor=None):
+        """Apply changes to the almost sold out set; a reconcile pass
+        also stores where the next one continues. Returns the set."""
+        entity = ndb.Key(AlmostSoldOut, 'conferences').get() or \
+            AlmostSoldOut(id='conferences')
+        almost = dict(entity.conferences or {})
+        for wsck, name in changes.iteritems():
+            if name:
+                almost[wsck] = name
+            else:
+                almost.pop(wsck, None)
+        entity.conferences = almost
+        if reconcile:
+            entity.cursor = websafeCursor
+        entity.put()
+        return almost
+
+
+    @staticmethod
+    def _setAnnouncement(almost):
+        """Set almost sold out set & Announcement in memcache."""
+        announcement = ConferenceApi._formatAnnouncement(almost)
+        memcache.set_multi({MEMCACHE_ALMOST_SOLD_OUT_KEY: almost,
+                            MEMCACHE_ANNOUNCEMENTS_KEY: announcement})
         return announcement
 
 
+    @staticmethod
+    def _updateAlmostSoldOut(confs):
+        """Add or remove Conferences whose seats crossed the almost sold
+        out threshold; nothing is written unless the set changes."""
+        changes = ConferenceApi._almostSoldOutChanges(
+            confs, ConferenceApi._getAlmostSoldOut())
+        if changes:
+            ConferenceApi._setAnnouncement(
+                ConferenceApi._putAlmostSoldOut(changes))
+
+
+    @staticmethod
+    def _cacheAnnouncement():
+        """Reconcile almost sold out Conferences & assign Announcement
+        to memcache; used by memcache cron job.
+        Rechecks the listed Conferences plus the next batch of all
+        Conferences, so missed updates are repaired over a few runs.
+        """
+        entity = ndb.Key(AlmostSoldOut, 'conferences').get()
+        almost = (entity and entity.conferences) or {}
+        cursor = Cursor(urlsafe=entity.cursor) \
+            if entity and entity.cursor else None
+        c_keys, cursor, more = Conference.query().fetch_page(
+            ALMOST_SOLD_OUT_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+        listed = [ndb.Key(urlsafe=wsck) for wsck in almost]
+        c_keys = listed + [c_key for c_key in c_keys if c_key not in listed]
+        confs = ndb.get_multi(c_keys)
+        # drop listed Conferences that were deleted
+        changes = {c_key.urlsafe(): None
+                   for c_key, conf in zip(c_keys, confs) if not conf}
+        changes.update(ConferenceApi._almostSoldOutChanges(
+            [conf for conf in confs if conf], almost))
+
+        almost = ConferenceApi._putAlmostSoldOut(changes, reconcile=True,
+            websafeCursor=cursor.urlsafe() if more and cursor else None)
+        return ConferenceApi._setAnnouncement(almost)
+
+
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
         announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
-        if not announcement:
-            announcement = ANNOUNCEMENT_TPL+str(time.ctime())
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        if announcement is None:
+            announcement = self._formatAnnouncement(self._getAlmostSoldOut())
+            memcache.add(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+        return StringMessage(data=announcement)
 
     @staticmethod
-    def _cacheFeaturedSpeaker(speaker):
-        """Create Featured Speaker & assign to memcache; used by
-        memcache cron job.
+    def _cacheFeaturedSpeaker(wsck):
+        """Create Featured Speaker for a Conference & assign to memcache;
+        used by the set featured speaker task & getFeaturedSpeaker().
         """
-        featured = ANNOUNCEMENT_FT + speaker
-        memcache.set(MEMCACHE_FEATURED_KEY, featured)
+        # the Speaker with the most sessions at this conference
+        speaker = Speaker.query(ancestor=ndb.Key(urlsafe=wsck)).\
+            order(-Speaker.sessionCount).get()
+
+        featured = {'speaker': None, 'sessionNames': []}
+        if speaker and speaker.sessionCount > 1:
+            featured['speaker'] = speaker.name
+            featured['sessionNames'] = [sess.name for sess in
+                ndb.get_multi(speaker.sessionKeys) if sess]
+        memcache.set(MEMCACHE_FEATURED_PREFIX + wsck, featured)
 
         return featured
 
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @endpoints.method(SessionQuery, FeaturedSpeakerForm,
             path='sessions/featured/get',
             http_method='GET', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
-        """get Featured Speaker."""
-        return StringMessage(data=memcache.get(MEMCACHE_FEATURED_KEY) or "")
+        """Get Featured Speaker of a conference."""
+        if not request.websafeConferenceKey:
+            raise endpoints.BadRequestException('Requires websafeConferenceKey.')
+        featured = memcache.get(MEMCACHE_FEATURED_PREFIX + request.websafeConferenceKey)
+        if featured is None:
+            featured = self._cacheFeaturedSpeaker(request.websafeConferenceKey)
+
+        if not featured['speaker']:
+            return FeaturedSpeakerForm(data="")
+        return FeaturedSpeakerForm(data=ANNOUNCEMENT_FT + featured['speaker'],
+                                   speaker=featured['speaker'],
+                                   sessionNames=featured['sessionNames'])
 
 
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
         retval = None
@@ -735,40 +1994,80 @@ class ConferenceApi(remote.Service):
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
+        if not conf.seatShards:
+            conf = self._createSeatShards(conf.key)
+
+        # seats are spread over shards; try them in random order so that
+        # concurrent registrations rarely contend on the same entity group
+        shards = range(conf.seatShards)
+        random.shuffle(shards)
+
+        # register; a shard still contended after the transaction's
+        # retries is skipped for the next one
+        if reg:
+            for attempt, index in enumerate(shards):
+                try:
+                    retval = self._updateSeatShard(prof.key, wsck, index, reg)
+                except datastore_errors.TransactionFailedError:
+                    if attempt == len(shards) - 1:
+                        raise
+                    continue
+                if retval is not None:
+                    break
+            else:
+                # check if seats avail
+                raise ConflictException(
+                    "There are no seats available.")
+
+        # unregister; any shard can take the seat back
+        else:
+            retval = self._updateSeatShard(prof.key, wsck, shards[0], reg)
+
+        if retval:
+            self._updateAlmostSoldOut([conf])
+        return BooleanMessage(data=retval)
+
+
+    @ndb.transactional(xg=True)
+    def _updateSeatShard(self, p_key, wsck, index, reg=True):
+        """Take (or give back) a seat on one SeatShard and update the user
+        Profile; returns None when registering on an empty shard."""
+        c_key = ndb.Key(urlsafe=wsck)
+        prof, shard = ndb.get_multi([p_key, self._seatShardKey(c_key, index)])
 
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if c_key in prof.conferenceKeysToAttend:
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
+            # no seats left on this shard, caller tries the next one
+            if not shard or shard.seatsAvailable <= 0:
+                return None
 
             # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
+            prof.conferenceKeysToAttend.append(c_key)
+            shard.seatsAvailable -= 1
+            offset = -1
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if c_key not in prof.conferenceKeysToAttend:
+                return False
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
+            # unregister user, add back one seat
+            prof.conferenceKeysToAttend.remove(c_key)
+            shard.seatsAvailable += 1
+            offset = 1
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+        # write things back to the datastore, adjust the cached total
+        # once committed & return
+        ndb.put_multi([prof, shard])
+        ndb.get_context().call_on_commit(lambda: memcache.offset_multi(
+            {wsck: offset}, key_prefix=MEMCACHE_SEATS_PREFIX))
+        return True
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -777,22 +2076,12 @@ class ConferenceApi(remote.Service):
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        wscks = [c_key.urlsafe() for c_key in prof.conferenceKeysToAttend]
+        forms = self._getCachedConferenceForms(wscks)
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
-        )
+        return ConferenceForms(items=[forms[wsck] for wsck in wscks
+                                      if wsck in forms])
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
@@ -811,6 +2100,219 @@ class ConferenceApi(remote.Service):
         return self._conferenceRegistration(request, reg=False)
 
 
+    @staticmethod
+    def _keyOrNotFound(websafeKey, kind, message):
+        """Return the Key encoded by websafeKey; raise NotFoundException
+        with message if it is malformed or not a Key of kind."""
+        try:
+            key = ndb.Key(urlsafe=websafeKey)
+        except (TypeError, ProtocolBufferDecodeError, datastore_errors.Error):
+            key = None
+        if not key or key.kind() != kind:
+            raise endpoints.NotFoundException(message)
+        return key
+
+
+    @staticmethod
+    def _scheduleRegistrations(wsck):
+        """Schedule the worker applying queued registrations of a
+        Conference; one named task per time window, run once the window
+        closed and queries see its PendingRegistrations."""
+        window = int(time.time() / REGISTRATION_QUEUE_DELAY)
+        ConferenceApi._addNamedTask('registrations-%s-%d' % (wsck, window),
+            params={'websafeConferenceKey': wsck},
+            url='/tasks/process_registrations',
+            countdown=(window + 1) * REGISTRATION_QUEUE_DELAY +
+                QUERY_INDEX_DELAY - time.time()
+        )
+
+
+    def _copyPendingRegistrationToForm(self, pending):
+        """Copy relevant fields from PendingRegistration to
+        RegistrationTicketForm."""
+        rf = RegistrationTicketForm(
+            ticket=pending.key.urlsafe(),
+            websafeConferenceKey=pending.conference.urlsafe(),
+            register=pending.register,
+            status=getattr(RegistrationStatus, pending.status),
+            message=pending.message,
+        )
+        rf.check_initialized()
+        return rf
+
+
+    def _queueRegistration(self, request, reg=True):
+        """Queue registration or unregistration for selected conference,
+        returning a ticket to poll with getRegistrationStatus()."""
+        prof = self._getProfileFromUser() # get user Profile
+
+        # get conference; check that it exists
+        wsck = request.websafeConferenceKey
+        c_key = ndb.Key(urlsafe=wsck)
+        if not c_key.get():
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+
+        # record the request as a child of the Profile; it is applied
+        # together with others for the same conference by the worker
+        pending = PendingRegistration(parent=prof.key, conference=c_key,
+                                      register=reg)
+        pending.put()
+
+        # a burst of requests is drained by a single task
+        self._scheduleRegistrations(wsck)
+        return self._copyPendingRegistrationToForm(pending)
+
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationTicketForm,
+            path='conference/{websafeConferenceKey}/queue',
+            http_method='POST', name='queueRegistrationForConference')
+    def queueRegistrationForConference(self, request):
+        """Queue registration of user for selected conference."""
+        return self._queueRegistration(request)
+
+
+    @endpoints.method(CONF_GET_REQUEST, RegistrationTicketForm,
+            path='conference/{websafeConferenceKey}/queue',
+            http_method='DELETE', name='queueUnregistrationFromConference')
+    def queueUnregistrationFromConference(self, request):
+        """Queue unregistration of user for selected conference."""
+        return self._queueRegistration(request, reg=False)
+
+
+    @endpoints.method(REG_GET_REQUEST, RegistrationTicketForm,
+            path='registration/{ticket}',
+            http_method='GET', name='getRegistrationStatus')
+    def getRegistrationStatus(self, request):
+        """Return status of a queued (un)registration by ticket."""
+        prof = self._getProfileFromUser() # get user Profile
+        message = 'No registration found with ticket: %s' % request.ticket
+        p_key = self._keyOrNotFound(
+            request.ticket, 'PendingRegistration', message)
+        # tickets are only visible to the user who queued them
+        if p_key.parent() != prof.key:
+            raise endpoints.NotFoundException(message)
+        pending = p_key.get()
+        if not pending:
+            raise endpoints.NotFoundException(message)
+        # the worker's query may have missed a ticket written just before
+        # it ran; schedule another run for tickets pending too long
+        if pending.status == 'PENDING' and (datetime.now() -
+                pending.created).total_seconds() > REGISTRATION_STALE_AFTER:
+            self._scheduleRegistrations(pending.conference.urlsafe())
+        return self._copyPendingRegistrationToForm(pending)
+
+
+    @staticmethod
+    def _processRegistrations(wsck):
+        """Apply queued registrations for a Conference in batches, one
+        transaction per batch; used by the process registrations task.
+        Returns True if registrations may still be pending.
+        """
+        c_key = ndb.Key(urlsafe=wsck)
+        conf = c_key.get()
+        if not conf:
+            return False
+        if not conf.seatShards:
+            conf = ConferenceApi._createSeatShards(c_key)
+
+        more = True
+        for _ in range(REGISTRATION_BATCHES_PER_TASK):
+            p_keys = PendingRegistration.query(
+                PendingRegistration.conference == c_key,
+                PendingRegistration.status == 'PENDING'
+            ).fetch(REGISTRATION_BATCH_SIZE, keys_only=True)
+            if not p_keys:
+                more = False
+                break
+
+            s_key = ConferenceApi._seatShardKey(
+                c_key, random.randrange(conf.seatShards))
+            if ConferenceApi._applyRegistrationBatch(wsck, s_key, p_keys):
+                # chosen shard ran out; fail the rest if all shards are empty
+                shards = ndb.get_multi(
+                    [ConferenceApi._seatShardKey(c_key, i)
+                     for i in range(conf.seatShards)], use_cache=False)
+                if not any(shard and shard.seatsAvailable > 0
+                           for shard in shards):
+                    ConferenceApi._failRegistrations(
+                        p_keys, "There are no seats available.")
+
+        ConferenceApi._updateAlmostSoldOut([conf])
+        return more
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _applyRegistrationBatch(wsck, s_key, p_keys):
+        """Apply a batch of PendingRegistrations against one SeatShard.
+        Returns True if some registrations were left pending because the
+        shard had no seats left.
+        """
+        c_key = ndb.Key(urlsafe=wsck)
+        shard = s_key.get()
+        pendings = [p for p in ndb.get_multi(p_keys)
+                    if p and p.status == 'PENDING']
+        pendings.sort(key=lambda p: p.created)
+        profs = dict(zip(
+            [p.key.parent() for p in pendings],
+            ndb.get_multi([p.key.parent() for p in pendings])))
+
+        offset = 0
+        starved = False
+        for pending in pendings:
+            prof = profs[pending.key.parent()]
+            if not prof:
+                pending.status = 'FAILED'
+                pending.message = 'No profile found.'
+            elif pending.register:
+                # check if user already registered otherwise add
+                if c_key in prof.conferenceKeysToAttend:
+                    pending.status = 'FAILED'
+                    pending.message = \
+                        'You have already registered for this conference'
+                elif not shard or shard.seatsAvailable <= 0:
+                    starved = True
+                    continue
+                else:
+                    prof.conferenceKeysToAttend.append(c_key)
+                    shard.seatsAvailable -= 1
+                    offset -= 1
+                    pending.status = 'REGISTERED'
+            else:
+                # check if user already registered
+                if c_key in prof.conferenceKeysToAttend:
+                    prof.conferenceKeysToAttend.remove(c_key)
+                    shard.seatsAvailable += 1
+                    offset += 1
+                    pending.status = 'UNREGISTERED'
+                else:
+                    pending.status = 'FAILED'
+                    pending.message = 'You are not registered for this conference'
+
+        # write the batch back in one go, adjust the cached seat total
+        # once committed
+        done = [p for p in pendings if p.status != 'PENDING']
+        ndb.put_multi(done + [p for p in profs.values() if p] +
+                      ([shard] if shard and offset else []))
+        if offset:
+            ndb.get_context().call_on_commit(lambda: memcache.offset_multi(
+                {wsck: offset}, key_prefix=MEMCACHE_SEATS_PREFIX))
+        return starved
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _failRegistrations(p_keys, message):
+        """Mark still pending registrations as FAILED."""
+        pendings = [p for p in ndb.get_multi(p_keys)
+                    if p and p.status == 'PENDING']
+        for pending in pendings:
+            pending.status = 'FAILED'
+            pending.message = message
+        ndb.put_multi(pendings)
+
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='filterPlayground',
             http_method='GET', name='filterPlayground')
@@ -826,9 +2328,11 @@ class ConferenceApi(remote.Service):
         q = q.filter(Conference.topics=="Medical Innovations")
         q = q.filter(Conference.month==6)
 
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
-        )
+        confs = q.fetch()
+        forms = [self._copyConferenceToForm(conf, "") for conf in confs]
+        self._setSeatsAvailable(forms, confs)
+        return ConferenceForms(items=forms)
 
 
-api = endpoints.api_server([ConferenceApi]) # register API
+# register API, recording per method metrics
+api = MetricsMiddleware(endpoints.api_server([ConferenceApi]))
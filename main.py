@@ -12,10 +12,29 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
 from conference import ConferenceApi
+from conference import IMPORT_BATCH_SIZE
+from conference import IMPORT_TASK_BYTES
+from conference import MEMCACHE_SENT_EMAIL_PREFIX
+from conference import SENT_EMAIL_TTL
+from conference import TRANSFER_KINDS
+from metrics import getMetrics
+
+# batches of Notifications sent per notifications cron run
+NOTIFICATION_ROUNDS = 10
+
+
+def _taskName(request):
+    """Return name of the task being run by request, or None."""
+    return request.headers.get('X-AppEngine-TaskName')
+
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
@@ -23,30 +42,229 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         ConferenceApi._cacheAnnouncement()
         self.response.set_status(204)
 
+class BumpConferenceGenerationHandler(webapp2.RequestHandler):
+    def post(self):
+        """Expire cached queryConferences responses once queries see
+        recently written Conferences."""
+        ConferenceApi._bumpConferenceGeneration()
+        self.response.set_status(204)
+
 class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
-        """Set Featured Speaker in Memcache."""
-        speaker = self.request.get('speaker')
-        ConferenceApi._cacheFeaturedSpeaker(speaker)
+        """Set Conference Featured Speaker in Memcache."""
+        wsck = self.request.get('websafeConferenceKey')
+        # tasks queued before featured speakers were per conference
+        # carry no conference; nothing to rebuild
+        if wsck:
+            ConferenceApi._cacheFeaturedSpeaker(wsck)
         self.response.set_status(204)
 
 
+class UpdateOrganizerNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy organizer displayName onto their Conferences in batches."""
+        user_id = self.request.get('userId')
+        cursor = ConferenceApi._updateOrganizerDisplayName(
+            user_id, self.request.get('cursor') or None)
+        # more conferences to rename; hand the next batch to a new task
+        if cursor:
+            ConferenceApi._addContinuationTask(_taskName(self.request),
+                params={'userId': user_id, 'cursor': cursor},
+                url='/tasks/update_organizer_name'
+            )
+        self.response.set_status(204)
+
+
+class ProcessRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Apply queued registrations for a Conference in batches."""
+        wsck = self.request.get('websafeConferenceKey')
+        # more registrations pending; hand them to a new task
+        if ConferenceApi._processRegistrations(wsck):
+            ConferenceApi._addContinuationTask(_taskName(self.request),
+                params={'websafeConferenceKey': wsck},
+                url='/tasks/process_registrations'
+            )
+        self.response.set_status(204)
+
+
+class MigrateAttendanceHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start converting Profile attendance lists to keys."""
+        self.post()
+
+    def post(self):
+        """Convert Profile attendance lists to keys in batches."""
+        cursor = ConferenceApi._migrateConferenceKeysToAttend(
+            self.request.get('cursor') or None)
+        # more profiles to convert; hand the next batch to a new task
+        if cursor:
+            ConferenceApi._addContinuationTask(_taskName(self.request),
+                params={'cursor': cursor},
+                url='/tasks/migrate_attendance'
+            )
+        self.response.set_status(204)
+
+
+class MigrateSpeakersHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start rebuilding Speakers of existing Sessions."""
+        self.post()
+
+    def post(self):
+        """Rebuild Speakers of existing Sessions in batches."""
+        cursor = ConferenceApi._migrateSpeakers(
+            self.request.get('cursor') or None)
+        # more conferences to rebuild; hand the next batch to a new task
+        if cursor:
+            ConferenceApi._addContinuationTask(_taskName(self.request),
+                params={'cursor': cursor},
+                url='/tasks/migrate_speakers'
+            )
+        self.response.set_status(204)
+
+
+class MigrateWishlistsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start re-keying Wishlist entries under their user."""
+        self.post()
+
+    def post(self):
+        """Re-key Wishlist entries under their user in batches."""
+        cursor = ConferenceApi._migrateWishlists(
+            self.request.get('cursor') or None)
+        # more entries to re-key; hand the next batch to a new task
+        if cursor:
+            ConferenceApi._addContinuationTask(_taskName(self.request),
+                params={'cursor': cursor},
+                url='/tasks/migrate_wishlists'
+            )
+        self.response.set_status(204)
+
+
+class ImportHandler(webapp2.RequestHandler):
+    def post(self):
+        """Split uploaded newline-delimited JSON into import tasks."""
+        notify = self.request.get('notify') == '1'
+        url = '/tasks/import_entities' + ('?notify=1' if notify else '')
+
+        def enqueue(chunk):
+            taskqueue.add(url=url, payload=''.join(chunk))
+
+        chunk, size, tasks = [], 0, 0
+        for line in self.request.body_file:
+            if chunk and (len(chunk) >= IMPORT_BATCH_SIZE or
+                          size + len(line) > IMPORT_TASK_BYTES):
+                enqueue(chunk)
+                chunk, size, tasks = [], 0, tasks + 1
+            chunk.append(line)
+            size += len(line)
+        if chunk:
+            enqueue(chunk)
+            tasks += 1
+        self.response.set_status(202)
+        self.response.write('%d import task(s) queued\n' % tasks)
+
+
+class ImportEntitiesHandler(webapp2.RequestHandler):
+    def post(self):
+        """Write a chunk of imported Conferences & Sessions."""
+        ConferenceApi._importEntities(self.request.body.splitlines(),
+                                      notify=self.request.get('notify') == '1')
+        self.response.set_status(204)
+
+
+class ExportHandler(webapp2.RequestHandler):
+    def get(self):
+        """Export a page of entities as newline-delimited JSON; fetch the
+        rest with the cursor in the X-Next-Cursor header."""
+        kind = self.request.get('kind')
+        if kind not in TRANSFER_KINDS:
+            self.abort(400, 'kind must be one of %s' % ', '.join(TRANSFER_KINDS))
+        records, cursor = ConferenceApi._exportEntities(
+            kind, self.request.get('cursor') or None)
+        self.response.content_type = 'application/x-ndjson'
+        if cursor:
+            self.response.headers['X-Next-Cursor'] = cursor
+        for record in records:
+            self.response.write(json.dumps(record) + '\n')
+
+
+class SendNotificationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send pending confirmation emails as per-recipient digests."""
+        for _ in range(NOTIFICATION_ROUNDS):
+            if not ConferenceApi._sendNotificationDigests():
+                break
+        self.response.set_status(204)
+
+
+def _formatConference(conf):
+    """Format a Conference summary for a confirmation email."""
+    dates = ' - '.join(d for d in (conf.get('startDate'), conf.get('endDate')) if d)
+    return '%s\r\n%s' % (conf.get('name'),
+                          ', '.join(i for i in (conf.get('city'), dates) if i))
+
+
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
         """Send email confirming Conference creation."""
+        # skip replayed tasks that already sent their email
+        task_name = _taskName(self.request)
+        sent_key = MEMCACHE_SENT_EMAIL_PREFIX + (task_name or '')
+        if task_name and memcache.get(sent_key):
+            return
+
+        # tasks queued before payloads were JSON carry form params
+        if self.request.get('conferenceInfo'):
+            email = self.request.get('email')
+            conferences = [self.request.get('conferenceInfo')]
+        else:
+            data = json.loads(self.request.body)
+            email = data['email']
+            conferences = [_formatConference(conf) for conf in data['conferences']]
+
+        if len(conferences) == 1:
+            subject = 'You created a new Conference!'
+            intro = 'Hi, you have created a following conference:'
+        else:
+            subject = 'You created %d new Conferences!' % len(conferences)
+            intro = 'Hi, you have created the following conferences:'
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
-            self.request.get('email'),                  # to
-            'You created a new Conference!',            # subj
-            'Hi, you have created a following '         # body
-            'conference:\r\n\r\n%s' % self.request.get(
-                'conferenceInfo')
+            email,                                      # to
+            subject,                                    # subj
+            '%s\r\n\r\n%s' % (intro,                   # body
+                '\r\n\r\n'.join(conferences))
         )
+        if task_name:
+            memcache.set(sent_key, 1, time=SENT_EMAIL_TTL)
+
+
+class MetricsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return rolling percentiles of ConferenceApi method metrics."""
+        names = ['ConferenceApi.' + name
+                 for name in sorted(ConferenceApi.all_remote_methods())]
+        self.response.content_type = 'application/json'
+        self.response.write(json.dumps(getMetrics(names), indent=2,
+                                       sort_keys=True))
 
 
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/send_notifications', SendNotificationsHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler),
+    ('/tasks/bump_conference_generation', BumpConferenceGenerationHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
+    ('/tasks/update_organizer_name', UpdateOrganizerNameHandler),
+    ('/tasks/process_registrations', ProcessRegistrationsHandler),
+    ('/tasks/migrate_attendance', MigrateAttendanceHandler),
+    ('/tasks/migrate_speakers', MigrateSpeakersHandler),
+    ('/tasks/migrate_wishlists', MigrateWishlistsHandler),
+    ('/tasks/import_entities', ImportEntitiesHandler),
+    ('/admin/import', ImportHandler),
+    ('/admin/export', ExportHandler),
+    ('/_ah/metrics', MetricsHandler),
 ], debug=True)
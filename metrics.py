@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""
+metrics.py -- lightweight per-method instrumentation for ConferenceApi
+    records wall time & RPC counts of each API call, kept as rolling
+    samples in memcache
+
+"""
+
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+MEMCACHE_METRICS_PREFIX = 'METRICS:'
+METRICS_WINDOW = 500        # samples per method kept in memcache
+METRICS_FLUSH = 20          # samples per method buffered before merging
+METRICS_PERCENTILES = (50, 90, 99)
+# sample fields; a sample is a tuple of these, in this order
+METRICS_FIELDS = ('wallMs', 'datastoreGets', 'datastoreQueries',
+                  'datastorePuts', 'memcacheHits', 'memcacheMisses', 'tasks')
+
+# counters of the API call running on this thread
+_local = threading.local()
+# method name -> samples not yet merged into memcache
+_pending = {}
+_pending_lock = threading.Lock()
+
+
+def _count(field, n=1):
+    """Add n to a counter of the current API call, if one is running."""
+    counts = getattr(_local, 'counts', None)
+    if counts is not None:
+        counts[field] += n
+
+
+def _rpcHook(service, call, request, response):
+    """Count datastore, memcache & task queue RPCs of API calls."""
+    if service == 'datastore_v3':
+        if call == 'Get':
+            _count('datastoreGets')
+        elif call == 'RunQuery':
+            _count('datastoreQueries')
+        elif call == 'Put':
+            _count('datastorePuts')
+    elif service == 'memcache' and call == 'Get':
+        hits = response.item_size()
+        _count('memcacheHits', hits)
+        _count('memcacheMisses', request.key_size() - hits)
+    elif service == 'taskqueue':
+        if call == 'Add':
+            _count('tasks')
+        elif call == 'BulkAdd':
+            _count('tasks', request.add_request_size())
+
+
+def installHooks():
+    """Install the RPC counting hook; adding it again is a no-op."""
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('metrics', _rpcHook)
+
+
+def startCounting():
+    """Start counting the RPCs made on this thread."""
+    _local.counts = dict.fromkeys(METRICS_FIELDS[1:], 0)
+
+
+def stopCounting():
+    """Stop counting RPCs on this thread, returning the counts."""
+    counts, _local.counts = getattr(_local, 'counts', None), None
+    return counts or dict.fromkeys(METRICS_FIELDS[1:], 0)
+
+
+def _flush(name, samples):
+    """Merge samples into the rolling window of a method in memcache."""
+    client = memcache.Client()
+    key = MEMCACHE_METRICS_PREFIX + name
+    for _ in range(3):
+        window = client.gets(key)
+        if window is None:
+            if client.add(key, samples[-METRICS_WINDOW:]):
+                return
+        elif client.cas(key, (window + samples)[-METRICS_WINDOW:]):
+            return
+
+
+def record(name, sample):
+    """Buffer a sample of a method, merging every METRICS_FLUSH samples."""
+    with _pending_lock:
+        samples = _pending.setdefault(name, [])
+        samples.append(sample)
+        if len(samples) < METRICS_FLUSH:
+            return
+        del _pending[name]
+    _flush(name, samples)
+
+
+def _percentile(values, pct):
+    """Return the pct'th percentile of sorted values."""
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def getMetrics(names):
+    """Return dict of method name -> call count & percentiles of each
+    sample field over the rolling window in memcache."""
+    windows = memcache.get_multi(names, key_prefix=MEMCACHE_METRICS_PREFIX)
+    metrics = {}
+    for name, samples in windows.iteritems():
+        if not samples:
+            continue
+        summary = {'calls': len(samples)}
+        for i, field in enumerate(METRICS_FIELDS):
+            values = sorted(sample[i] for sample in samples)
+            summary[field] = dict(
+                ('p%d' % pct, _percentile(values, pct))
+                for pct in METRICS_PERCENTILES)
+        metrics[name] = summary
+    return metrics
+
+
+class MetricsMiddleware(object):
+    """WSGI middleware recording a sample per API call, named after the
+    method in the SPI path, e.g. ConferenceApi.getConference."""
+
+    def __init__(self, app):
+        self.app = app
+        installHooks()
+
+    def __call__(self, environ, start_response):
+        name = environ.get('PATH_INFO', '').rsplit('/', 1)[-1]
+        startCounting()
+        start = time.time()
+        try:
+            return self.app(environ, start_response)
+        finally:
+            counts = stopCounting()
+            record(name, ((time.time() - start) * 1000,) +
+                   tuple(counts[field] for field in METRICS_FIELDS[1:]))
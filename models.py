@@ -26,7 +26,21 @@ class Profile(ndb.Model):
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    conferenceKeysToAttend = ndb.KeyProperty('conferencesToAttend',
+                                             kind='Conference', repeated=True)
+    # websafe keys stored before attendance was kept as keys; moved into
+    # conferenceKeysToAttend on load and cleared by the migration task
+    legacyConferenceKeysToAttend = ndb.StringProperty('conferenceKeysToAttend',
+                                                      repeated=True)
+
+    @classmethod
+    def _post_get_hook(cls, key, future):
+        profile = future.get_result()
+        if profile and profile.legacyConferenceKeysToAttend:
+            profile.conferenceKeysToAttend.extend(
+                ndb.Key(urlsafe=wsck)
+                for wsck in profile.legacyConferenceKeysToAttend)
+            profile.legacyConferenceKeysToAttend = []
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -53,6 +67,7 @@ class Conference(ndb.Model):
     name            = ndb.StringProperty(required=True)
     description     = ndb.StringProperty()
     organizerUserId = ndb.StringProperty()
+    organizerDisplayName = ndb.StringProperty()
     topics          = ndb.StringProperty(repeated=True)
     city            = ndb.StringProperty()
     startDate       = ndb.DateProperty()
@@ -60,6 +75,12 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    seatShards      = ndb.IntegerProperty(default=0)
+
+class SeatShard(ndb.Model):
+    """SeatShard -- slice of a Conference's available seats"""
+    conference      = ndb.KeyProperty(kind=Conference)
+    seatsAvailable  = ndb.IntegerProperty(default=0)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -76,6 +97,33 @@ class ConferenceForm(messages.Message):
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
 
+class AlmostSoldOut(ndb.Model):
+    """AlmostSoldOut -- Conferences with few seats left, for the announcement"""
+    conferences     = ndb.JsonProperty()    # websafe key -> name
+    cursor          = ndb.StringProperty(indexed=False)
+
+class Notification(ndb.Model):
+    """Notification -- pending Conference confirmation email"""
+    email           = ndb.StringProperty(required=True)
+    conference      = ndb.JsonProperty()
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class PendingRegistration(ndb.Model):
+    """PendingRegistration -- queued (un)registration, child of Profile"""
+    conference      = ndb.KeyProperty(kind=Conference)
+    register        = ndb.BooleanProperty(default=True)
+    status          = ndb.StringProperty(default='PENDING')
+    message         = ndb.StringProperty()
+    created         = ndb.DateTimeProperty(auto_now_add=True)
+
+class RegistrationTicketForm(messages.Message):
+    """RegistrationTicketForm -- queued registration outbound form message"""
+    ticket          = messages.StringField(1)
+    websafeConferenceKey = messages.StringField(2)
+    register        = messages.BooleanField(3)
+    status          = messages.EnumField('RegistrationStatus', 4)
+    message         = messages.StringField(5)
+
 class Session(ndb.Model):
     """Session -- Session object"""
     name            = ndb.StringProperty(required=True)
@@ -86,6 +134,12 @@ class Session(ndb.Model):
     date       = ndb.DateProperty()
     startTime           = ndb.TimeProperty()
 
+class Speaker(ndb.Model):
+    """Speaker -- speaker's Sessions at a Conference, child of Conference"""
+    name            = ndb.StringProperty(required=True)
+    sessionCount    = ndb.IntegerProperty(default=0)
+    sessionKeys     = ndb.KeyProperty(kind=Session, repeated=True)
+
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
     name            = messages.StringField(1)
@@ -130,11 +184,19 @@ class WishlistTypeQuery(messages.Message):
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    explain = messages.StringField(3)
 
 class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
 
+class FeaturedSpeakerForm(messages.Message):
+    """FeaturedSpeakerForm -- Conference featured speaker outbound form message"""
+    data = messages.StringField(1)
+    speaker = messages.StringField(2)
+    sessionNames = messages.StringField(3, repeated=True)
+
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
     NOT_SPECIFIED = 1
@@ -153,6 +215,13 @@ class TeeShirtSize(messages.Enum):
     XXXL_M = 14
     XXXL_W = 15
 
+class RegistrationStatus(messages.Enum):
+    """RegistrationStatus -- queued registration status enumeration value"""
+    PENDING = 1
+    REGISTERED = 2
+    UNREGISTERED = 3
+    FAILED = 4
+
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
     field = messages.StringField(1)
@@ -162,6 +231,10 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    debug = messages.BooleanField(4)
+    fields = messages.StringField(5, repeated=True)
 
 class SessionQuery(messages.Message):
     """SessionQueryForm -- Session query inbound form message"""
@@ -175,3 +248,13 @@ class SessionQueryType(messages.Message):
     """SessionQueryForm -- Session query inbound form message"""
     typeOfSession = messages.StringField(1)
     websafeConferenceKey = messages.StringField(2)
+
+class SessionSearchForm(messages.Message):
+    """SessionSearchForm -- Session search inbound form message"""
+    websafeConferenceKey = messages.StringField(1)
+    startTimeFrom = messages.StringField(2)
+    startTimeTo = messages.StringField(3)
+    includeTypes = messages.StringField(4, repeated=True)
+    excludeTypes = messages.StringField(5, repeated=True)
+    speaker = messages.StringField(6)
+    date = messages.StringField(7)
@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+
+"""
+test_conference.py -- ConferenceApi tests against the App Engine testbed
+
+run with: APPENGINE_SDK=[SDK DIR] python -m unittest test_conference
+
+"""
+
+import sys
+import threading
+import unittest
+
+from testing import TestbedTestCase
+from testing import apiFor
+
+
+class RegistrationLoadTest(TestbedTestCase):
+    """Concurrent registrations on sharded vs single seat counters."""
+
+    USERS = 120
+    SEATS = 2000        # enough that no shard runs out
+
+    def setUp(self):
+        from google.appengine.api import apiproxy_stub_map
+        super(RegistrationLoadTest, self).setUp()
+        self.attempts = 0
+        self.errors = []
+        self.lock = threading.Lock()
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'loadtest', self._countTransactions)
+        self.emails = self.seedProfiles(self.USERS)
+
+    def _countTransactions(self, service, call, request, response):
+        if service == 'datastore_v3' and call == 'BeginTransaction':
+            with self.lock:
+                self.attempts += 1
+
+    def _burst(self, c_key):
+        """Register every user concurrently, one thread each; returns
+        (registrations, transaction attempts that didn't commit). Calls
+        that raised are kept in self.errors."""
+        from conference import CONF_GET_REQUEST
+        request = CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=c_key.urlsafe())
+        registered = []
+
+        def register(email):
+            try:
+                if apiFor(email)._conferenceRegistration(request).data:
+                    with self.lock:
+                        registered.append(email)
+            except Exception as e:
+                with self.lock:
+                    self.errors.append(e)
+
+        threads = [threading.Thread(target=register, args=(email,))
+                   for email in self.emails]
+        self.attempts = 0
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(registered), self.attempts - len(registered)
+
+    def _seatsLeft(self, c_key):
+        from google.appengine.ext import ndb
+        from conference import ConferenceApi
+        # skip this thread's context cache, written when seeding
+        conf = c_key.get(use_cache=False, use_memcache=False)
+        return sum(shard.seatsAvailable for shard in ndb.get_multi(
+            [ConferenceApi._seatShardKey(c_key, i)
+             for i in range(conf.seatShards)],
+            use_cache=False, use_memcache=False))
+
+    def testShardedSeatsCollideLess(self):
+        organizer = self.emails[0]
+        single = self.seedConference(organizer, seats=self.SEATS, shards=1)
+        sharded = self.seedConference(organizer, seats=self.SEATS)
+
+        single_ok, single_collisions = self._burst(single)
+        single_errors, self.errors = self.errors, []
+        sharded_ok, sharded_collisions = self._burst(sharded)
+        sys.stderr.write(
+            '\n%d concurrent registrations: single counter %d ok, %d '
+            'collisions; sharded %d ok, %d collisions\n' % (
+                self.USERS, single_ok, single_collisions,
+                sharded_ok, sharded_collisions))
+
+        # the single counter may give up under contention, but only by
+        # failing to commit; sharded registrations all get a seat
+        from google.appengine.api import datastore_errors
+        self.assertGreater(single_ok, 0)
+        self.assertTrue(all(isinstance(e, datastore_errors.TransactionFailedError)
+                            for e in single_errors), single_errors[:1])
+        self.assertEqual(self.errors, [])
+        self.assertEqual(sharded_ok, self.USERS)
+
+        # every committed registration took exactly one seat
+        self.assertEqual(self._seatsLeft(single), self.SEATS - single_ok)
+        self.assertEqual(self._seatsLeft(sharded), self.SEATS - sharded_ok)
+        self.assertGreaterEqual(sharded_ok, single_ok)
+        self.assertLessEqual(sharded_collisions, single_collisions)
+
+
+class ConferenceQueryRpcTest(TestbedTestCase):
+    """Datastore RPCs of conference listings don't grow with results.
+
+    The datastore splits a batch get of many entity groups into several
+    Get RPCs sent together, so gets are counted in round trips: runs of
+    Get RPCs started before any of them returned.
+    """
+
+    ORGANIZERS = 10
+    CONFERENCES = 30
+
+    def setUp(self):
+        from google.appengine.api import apiproxy_stub_map
+        super(ConferenceQueryRpcTest, self).setUp()
+        self.inflight = self.roundTrips = 0
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'roundtrips', self._startGet)
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'roundtrips', self._endGet)
+        self.emails = self.seedProfiles(self.ORGANIZERS)
+        for i in range(self.CONFERENCES):
+            self.seedConference(self.emails[i % self.ORGANIZERS],
+                                name='Conference %d' % i)
+        # a legacy Conference whose organizer name comes from the Profile
+        self.seedConference(self.emails[0], organizerDisplayName=None)
+
+    def _startGet(self, service, call, request, response):
+        if service == 'datastore_v3' and call == 'Get':
+            if not self.inflight:
+                self.roundTrips += 1
+            self.inflight += 1
+
+    def _endGet(self, service, call, request, response, rpc=None):
+        if service == 'datastore_v3' and call == 'Get':
+            self.inflight -= 1
+
+    def _count(self, email, method, request):
+        """Call method as a fresh request of email, returning (response,
+        RPC counts plus the round trips of datastore gets)."""
+        from google.appengine.ext import ndb
+        import metrics
+        ndb.get_context().clear_cache()
+        api = apiFor(email)
+        self.roundTrips = 0
+        metrics.startCounting()
+        try:
+            response = getattr(api, method)(request)
+        finally:
+            counts = metrics.stopCounting()
+        counts['getRoundTrips'] = self.roundTrips
+        return response, counts
+
+    def testQueryConferences(self):
+        from models import ConferenceQueryForms
+        response, cold = self._count(
+            self.emails[0], 'queryConferences', ConferenceQueryForms())
+        self.assertEqual(len(response.items), self.CONFERENCES + 1)
+        self.assertTrue(all(form.organizerDisplayName
+                            for form in response.items))
+        # one query; organizer names & seat shards in one batch each
+        self.assertEqual(cold['datastoreQueries'], 1)
+        self.assertLessEqual(cold['getRoundTrips'], 2)
+
+        # served from memcache with the seat totals cached alongside
+        response, warm = self._count(
+            self.emails[1], 'queryConferences', ConferenceQueryForms())
+        self.assertEqual(len(response.items), self.CONFERENCES + 1)
+        self.assertEqual(warm['datastoreQueries'], 0)
+        self.assertEqual(warm['datastoreGets'], 0)
+
+    def testGetConferencesCreated(self):
+        from conference import CONF_FIELDS_REQUEST
+        response, counts = self._count(self.emails[0], 'getConferencesCreated',
+            CONF_FIELDS_REQUEST.combined_message_class())
+        self.assertEqual(len(response.items),
+                         self.CONFERENCES / self.ORGANIZERS + 1)
+        self.assertEqual(counts['datastoreQueries'], 1)
+        self.assertLessEqual(counts['getRoundTrips'], 2)
+
+
+class ConferenceQueryPlanTest(TestbedTestCase):
+    """queryConferences plans: pushed down vs in memory filters."""
+
+    # name, city, month, maxAttendees, topics
+    CONFERENCES = [
+        ('A', 'London', 3, 50, ['Web', 'Health']),
+        ('B', 'Paris', 6, 5, ['Web']),
+        ('C', 'Tokyo', 10, 200, ['Movies']),
+        ('D', 'London', 7, 20, ['Health']),
+        ('E', 'Berlin', 1, 120, ['Web', 'Movies']),
+        ('F', 'Paris', 12, 80, ['Health', 'Web']),
+        ('G', 'Chicago', 5, 15, []),
+    ]
+
+    def setUp(self):
+        super(ConferenceQueryPlanTest, self).setUp()
+        self.email = self.seedProfiles(1)[0]
+        for name, city, month, seats, topics in self.CONFERENCES:
+            self.seedConference(self.email, name=name, city=city,
+                                month=month, seats=seats, topics=topics,
+                                shards=0)
+
+    def _request(self, filters, **kwargs):
+        from models import ConferenceQueryForm
+        from models import ConferenceQueryForms
+        return ConferenceQueryForms(filters=[
+            ConferenceQueryForm(field=f, operator=o, value=v)
+            for f, o, v in filters], **kwargs)
+
+    def _names(self, response):
+        return [form.name for form in response.items]
+
+    def _expected(self, match):
+        return sorted(c[0] for c in self.CONFERENCES if match(*c[1:]))
+
+    def testTwoInequalities(self):
+        response = apiFor(self.email).queryConferences(self._request(
+            [('MAX_ATTENDEES', 'GT', '10'), ('MONTH', 'LT', '9')],
+            debug=True))
+        self.assertEqual(response.explain,
+            'datastore: month < 9 order by month, name; '
+            'in memory: maxAttendees > 10')
+        self.assertEqual(sorted(self._names(response)), self._expected(
+            lambda city, month, seats, topics: seats > 10 and month < 9))
+
+    def testResidualTopics(self):
+        # a repeated property matches if any of its values does
+        response = apiFor(self.email).queryConferences(self._request(
+            [('TOPIC', 'NE', 'Web'), ('MAX_ATTENDEES', 'GT', '10')],
+            debug=True))
+        self.assertEqual(response.explain,
+            'datastore: maxAttendees > 10 order by maxAttendees, name; '
+            'in memory: topics != Web')
+        self.assertEqual(sorted(self._names(response)), self._expected(
+            lambda city, month, seats, topics: seats > 10 and
+                any(topic != 'Web' for topic in topics)))
+
+    def testNeedIndexFallsBack(self):
+        from google.appengine.api import datastore_errors
+        api = apiFor(self.email)
+        fetch = api._fetchConferences
+        plans = []
+
+        def fetchWithoutIndex(q, request, projection=None):
+            plans.append(q)
+            if len(plans) == 1:
+                raise datastore_errors.NeedIndexError('no index')
+            return fetch(q, request, projection)
+        api._fetchConferences = fetchWithoutIndex
+
+        response = api.queryConferences(self._request(
+            [('CITY', 'EQ', 'London'), ('MONTH', 'GT', '4')], debug=True))
+        self.assertEqual(len(plans), 2)
+        self.assertEqual(response.explain,
+            'datastore: city = London order by name; in memory: month > 4 '
+            '(1 plan(s) skipped for missing indexes)')
+        self.assertEqual(self._names(response), self._expected(
+            lambda city, month, seats, topics: city == 'London' and month > 4))
+
+    def testExplain(self):
+        api = apiFor(self.email)
+        response = api.queryConferences(self._request([], debug=True))
+        self.assertEqual(response.explain,
+                         'datastore: none order by name; in memory: none')
+        self.assertEqual(self._names(response), self._expected(
+            lambda *conf: True))
+        response = api.queryConferences(self._request(
+            [('MONTH', 'GTEQ', '6')], fields=['name', 'month'], debug=True))
+        self.assertEqual(response.explain,
+            'datastore: month >= 6 order by month, name; in memory: none; '
+            'projection: month, name')
+        # no explain unless asked for
+        response = api.queryConferences(self._request([('MONTH', 'GTEQ', '6')]))
+        self.assertIsNone(response.explain)
+
+    def _pages(self, request):
+        """Return names of all pages of request, and the page count."""
+        api = apiFor(self.email)
+        names, pages = [], 0
+        while True:
+            response = api.queryConferences(request)
+            names.extend(self._names(response))
+            pages += 1
+            if not response.nextPageToken:
+                return names, pages
+            request.pageToken = response.nextPageToken
+
+    def testPagedNotEqual(self):
+        expected = [c[0] for c in sorted(self.CONFERENCES,
+                                         key=lambda c: (c[1], c[0]))
+                    if c[1] != 'London']
+        for fields in ([], ['name', 'city']):
+            names, pages = self._pages(self._request(
+                [('CITY', 'NE', 'London')], pageSize=2, fields=fields))
+            # ordered by city, then name, without repeats or gaps
+            self.assertEqual(names, expected)
+            self.assertEqual(pages, 3)
+
+
+class SessionSearchTest(TestbedTestCase):
+    """searchSessions against the cached session timetable."""
+
+    # name, startTime, types, speaker, date
+    SESSIONS = [
+        ('Midnight', (0, 0), ['Workshop'], 'Ann', (2026, 6, 1)),
+        ('Morning', (9, 30), ['Lecture', 'Keynote'], 'Bob', (2026, 6, 1)),
+        ('Noon', (12, 0), ['Workshop', 'Lecture'], 'Ann', (2026, 6, 2)),
+        ('Evening', (19, 45), ['Panel'], 'Cy', (2026, 6, 2)),
+        ('Unscheduled', None, ['Lecture'], 'Bob', None),
+    ]
+
+    def setUp(self):
+        from datetime import date
+        from datetime import time
+        from conference import ConferenceApi
+        super(SessionSearchTest, self).setUp()
+        self.email = self.seedProfiles(1)[0]
+        self.c_key = self.seedConference(self.email, shards=0)
+        ConferenceApi._putSessions(self.c_key, [{
+            'name': name,
+            'startTime': time(*start) if start else None,
+            'typeOfSession': types,
+            'speaker': speaker,
+            'date': date(*day) if day else None,
+        } for name, start, types, speaker, day in self.SESSIONS])
+
+    def _search(self, **kwargs):
+        from models import SessionSearchForm
+        response = apiFor(self.email).searchSessions(SessionSearchForm(
+            websafeConferenceKey=self.c_key.urlsafe(), **kwargs))
+        return sorted(form.name for form in response.items)
+
+    def testNoFilters(self):
+        self.assertEqual(self._search(),
+                         sorted(sess[0] for sess in self.SESSIONS))
+
+    def testMidnightBounds(self):
+        # a range leaves out unscheduled sessions, even from midnight
+        self.assertEqual(self._search(startTimeTo='00:00'), ['Midnight'])
+        self.assertEqual(self._search(startTimeFrom='00:00'),
+                         ['Evening', 'Midnight', 'Morning', 'Noon'])
+        self.assertEqual(self._search(startTimeFrom='09:30',
+                                      startTimeTo='12:00'),
+                         ['Morning', 'Noon'])
+
+    def testTypesSpeakerDate(self):
+        self.assertEqual(self._search(includeTypes=['Lecture']),
+                         ['Morning', 'Noon', 'Unscheduled'])
+        self.assertEqual(self._search(excludeTypes=['Workshop']),
+                         ['Evening', 'Morning', 'Unscheduled'])
+        self.assertEqual(self._search(startTimeTo='19:00',
+                                      excludeTypes=['Workshop']),
+                         ['Morning'])
+        self.assertEqual(self._search(speaker='Ann'), ['Midnight', 'Noon'])
+        self.assertEqual(self._search(date='2026-06-02'), ['Evening', 'Noon'])
+
+    def testBadTime(self):
+        import endpoints
+        with self.assertRaises(endpoints.BadRequestException):
+            self._search(startTimeFrom='9am')
+
+    def testCreateSessionInvalidatesTimetable(self):
+        from models import SessionForm
+        self.assertEqual(self._search(startTimeFrom='20:00'), [])
+        apiFor(self.email).createSession(SessionForm(
+            name='Late', startTime='21:00', typeOfSession=['Panel'],
+            date='2026-06-02', confwebsafeKey=self.c_key.urlsafe()))
+        self.assertEqual(self._search(startTimeFrom='20:00'), ['Late'])
+
+
+class WishlistTest(TestbedTestCase):
+    """Wishlist entries keyed under their user."""
+
+    def setUp(self):
+        from google.appengine.ext import ndb
+        from conference import ConferenceApi
+        from models import Session
+        super(WishlistTest, self).setUp()
+        self.email = self.seedProfiles(1)[0]
+        self.c_key = self.seedConference(self.email, shards=0)
+        ConferenceApi._putSessions(self.c_key, [
+            {'name': 'Session %d' % i, 'speaker': 'Ann',
+             'typeOfSession': ['Workshop' if i % 2 else 'Lecture']}
+            for i in range(4)])
+        self.s_keys = Session.query(ancestor=self.c_key).order(
+            Session.key).fetch(keys_only=True)
+        self.ndb = ndb
+
+    def _add(self, s_key):
+        from models import WishlistForm
+        return apiFor(self.email).addSessionToWishlist(
+            WishlistForm(sessionKey=s_key))
+
+    def _wishlist(self):
+        from protorpc import message_types
+        return sorted(form.sessionName for form in apiFor(
+            self.email).getSessionsInWishlist(
+                message_types.VoidMessage()).items)
+
+    def testAddedEntriesAreReadBack(self):
+        # only ancestor queries see writes this policy leaves unapplied
+        from google.appengine.datastore import datastore_stub_util
+        from models import WishlistSpeakerQuery
+        from models import WishlistTypeQuery
+        self.testbed.get_stub('datastore_v3').SetConsistencyPolicy(
+            datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=0))
+        self._add(self.s_keys[0].urlsafe())
+        self._add(self.s_keys[1].urlsafe())
+        self.assertEqual(self._wishlist(), ['Session 0', 'Session 1'])
+        api = apiFor(self.email)
+        self.assertEqual([form.sessionName for form in api.getWishlistByType(
+            WishlistTypeQuery(typeOfSession='Workshop')).items], ['Session 1'])
+        self.assertEqual(len(api.getWishlistBySpeaker(
+            WishlistSpeakerQuery(speaker='Ann')).items), 2)
+
+    def testDuplicateAndBadKeys(self):
+        import endpoints
+        self._add(self.s_keys[0].urlsafe())
+        with self.assertRaises(endpoints.UnauthorizedException):
+            self._add(self.s_keys[0].urlsafe())
+        for key in ('not-a-key', self.c_key.urlsafe()):
+            with self.assertRaises(endpoints.NotFoundException):
+                self._add(key)
+
+    def testMigrateLegacyEntries(self):
+        import endpoints
+        from conference import ConferenceApi
+        from models import Wishlist
+        ndb = self.ndb
+        # entries as written before, children of the Session; session 0
+        # was wishlisted twice
+        legacy = []
+        for s_key in self.s_keys[:2] + self.s_keys[:1]:
+            w_id = Wishlist.allocate_ids(size=1, parent=s_key)[0]
+            legacy.append(Wishlist(key=ndb.Key(Wishlist, w_id, parent=s_key),
+                                   sessionName=s_key.get().name,
+                                   userId=self.email, sessionKey=s_key,
+                                   typeOfSession=['Lecture']))
+        ndb.put_multi(legacy)
+        self._add(self.s_keys[2].urlsafe())
+
+        cursor, batches = None, 0
+        while True:
+            cursor = ConferenceApi._migrateWishlists(cursor)
+            batches += 1
+            if not cursor:
+                break
+        self.assertEqual(self._wishlist(),
+                         ['Session 0', 'Session 1', 'Session 2'])
+        self.assertEqual(ndb.get_multi([w.key for w in legacy]),
+                         [None] * len(legacy))
+        self.assertEqual(Wishlist.query().count(), 3)
+        # migrated entries are covered by the duplicate check
+        with self.assertRaises(endpoints.UnauthorizedException):
+            self._add(self.s_keys[1].urlsafe())
+        # replaying the migration changes nothing
+        ConferenceApi._migrateWishlists()
+        self.assertEqual(Wishlist.query().count(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
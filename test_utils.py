@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""
+test_utils.py -- OAuth user ID lookups against the fake tokeninfo stub
+
+run with: APPENGINE_SDK=[SDK DIR] python -m unittest test_utils
+
+"""
+
+import os
+import unittest
+
+from testing import TestbedTestCase
+
+
+class OAuthUserIdTest(TestbedTestCase):
+    """getOAuthUserIdAsync against tokeninfo_stub."""
+
+    def setUp(self):
+        super(OAuthUserIdTest, self).setUp()
+        import utils
+        utils._tokeninfo_cache.clear()
+        self.utils = utils
+
+    def tearDown(self):
+        os.environ.pop('HTTP_AUTHORIZATION', None)
+        os.environ.pop('OAUTH_USER_ID', None)
+        super(OAuthUserIdTest, self).tearDown()
+
+    def _userId(self, token):
+        os.environ['HTTP_AUTHORIZATION'] = 'Bearer %s' % token
+        return self.utils.getOAuthUserIdAsync().get_result()
+
+    def testVerifiedTokenIsCached(self):
+        import tokeninfo_stub
+        stub = tokeninfo_stub.install(tokens={'good': '1234'},
+                                      idTokens=['good'])
+        self.assertEqual(self._userId('good'), '1234')
+        # served from the instance cache
+        self.assertEqual(self._userId('good'), '1234')
+        # served from memcache on another instance
+        self.utils._tokeninfo_cache.clear()
+        self.assertEqual(self._userId('good'), '1234')
+        self.assertEqual(stub.calls, [('id_token', 'good')])
+
+    def testAccessTokenFallback(self):
+        import tokeninfo_stub
+        stub = tokeninfo_stub.install(tokens={'access': '5678'})
+        self.assertEqual(self._userId('access'), '5678')
+        self.assertEqual(stub.calls, [('id_token', 'access'),
+                                      ('access_token', 'access')])
+
+    def testUnknownTokenIsNotCached(self):
+        import tokeninfo_stub
+        stub = tokeninfo_stub.install()
+        os.environ['OAUTH_USER_ID'] = '0'
+        self.assertEqual(self._userId('bad'), '')
+        self.assertEqual(self._userId('bad'), '')
+        self.assertEqual(len(stub.calls), 2 * self.utils.TOKENINFO_ATTEMPTS)
+
+    def testServerErrorIsRetried(self):
+        import tokeninfo_stub
+        stub = tokeninfo_stub.install(tokens={'good': '1234'},
+                                      idTokens=['good'], failures=1)
+        self.assertEqual(self._userId('good'), '1234')
+        self.assertEqual(len(stub.calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
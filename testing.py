@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+"""
+testing.py -- App Engine testbed helpers shared by the tests & benchmark
+    puts the SDK on sys.path and activates the local service stubs
+
+"""
+
+import os
+import sys
+import unittest
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+APP_ID = 'stone-index-91501'
+DEFAULT_SDK = os.environ.get('APPENGINE_SDK', '/usr/local/google_appengine')
+
+
+def setupPath(sdk=DEFAULT_SDK):
+    """Put the App Engine SDK & its bundled libraries on sys.path;
+    returns False if the SDK can't be found."""
+    if sdk not in sys.path:
+        sys.path.insert(0, sdk)
+    try:
+        import dev_appserver
+    except ImportError:
+        return False
+    dev_appserver.fix_sys_path()
+    if APP_ROOT not in sys.path:
+        sys.path.insert(0, APP_ROOT)
+    return True
+
+
+def activateTestbed():
+    """Activate a testbed with the stubs the app uses; every query sees
+    all writes, like a warmed up production index."""
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+    import metrics
+
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.setup_env(app_id=APP_ID, overwrite=True,
+                 CURRENT_VERSION_ID='1.1',
+                 ENDPOINTS_AUTH_EMAIL='', ENDPOINTS_AUTH_DOMAIN='gmail.com')
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+    tb.init_datastore_v3_stub(consistency_policy=policy)
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=APP_ROOT)
+    tb.init_urlfetch_stub()
+    tb.init_mail_stub()
+    tb.init_app_identity_stub()
+    tb.init_user_stub()
+    metrics.installHooks()
+    return tb
+
+
+def clearCaches():
+    """Drop memcache & the in-context & in-process caches."""
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+    import conference
+    memcache.flush_all()
+    ndb.get_context().clear_cache()
+    conference._conference_cache.clear()
+
+
+def apiFor(email):
+    """Return a ConferenceApi instance acting as a request of user email;
+    the user is set on the instance, so it can be used on any thread."""
+    from google.appengine.api import users
+    import conference
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+    api = conference.ConferenceApi()
+    api._currentUser = users.User(email)
+    api._currentUserId = email
+    return api
+
+
+HAVE_SDK = setupPath()
+
+
+@unittest.skipUnless(HAVE_SDK, 'App Engine SDK not found; set APPENGINE_SDK')
+class TestbedTestCase(unittest.TestCase):
+    """Base TestCase running against a fresh testbed."""
+
+    def setUp(self):
+        self.testbed = activateTestbed()
+        clearCaches()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def seedProfiles(self, count):
+        """Write count Profiles, returning their emails (= user IDs)."""
+        from google.appengine.ext import ndb
+        from models import Profile
+        emails = ['user%d@example.com' % i for i in range(count)]
+        ndb.put_multi([Profile(key=ndb.Key(Profile, email),
+                               displayName=email.split('@')[0],
+                               mainEmail=email,
+                               teeShirtSize='NOT_SPECIFIED')
+                       for email in emails])
+        return emails
+
+    def seedConference(self, organizer, name='Conference', seats=100,
+                       shards=None, **props):
+        """Write a Conference split over shards SeatShards (by default
+        NUM_SEAT_SHARDS; 0 writes it unsharded), returning its key."""
+        from google.appengine.ext import ndb
+        from conference import ConferenceApi
+        from conference import NUM_SEAT_SHARDS
+        from models import Conference
+        from models import Profile
+        p_key = ndb.Key(Profile, organizer)
+        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
+        props.setdefault('organizerDisplayName', organizer.split('@')[0])
+        conf = Conference(key=ndb.Key(Conference, c_id, parent=p_key),
+                          name=name, organizerUserId=organizer,
+                          city=props.pop('city', 'London'),
+                          maxAttendees=seats, seatsAvailable=seats, **props)
+        if shards is None:
+            shards = NUM_SEAT_SHARDS
+        ndb.put_multi((ConferenceApi._makeSeatShards(conf, shards)
+                       if shards else []) + [conf])
+        return conf.key
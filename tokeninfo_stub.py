@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+"""
+tokeninfo_stub.py -- local fake of the OAuth tokeninfo endpoint
+    a urlfetch service stub answering TOKENINFO_URL requests from a dict
+    of known tokens, so getOAuthUserIdAsync runs without the network
+
+"""
+
+import json
+import threading
+import urlparse
+
+from google.appengine.api import apiproxy_stub
+from google.appengine.api import apiproxy_stub_map
+
+
+class FakeTokeninfoStub(apiproxy_stub.APIProxyStub):
+    """urlfetch stub answering tokeninfo lookups.
+
+    tokens maps token -> user ID of the tokens tokeninfo accepts; those
+    in idTokens are only accepted as id_token, the others only as
+    access_token, like the real endpoint. The first failures fetches
+    answer 500. Fetched (token type, token) pairs are kept in calls.
+    """
+
+    def __init__(self, tokens=None, idTokens=(), expiresIn=3600, failures=0):
+        super(FakeTokeninfoStub, self).__init__('urlfetch')
+        self.tokens = dict(tokens or {})
+        self.idTokens = set(idTokens)
+        self.expiresIn = expiresIn
+        self.failures = failures
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _Dynamic_Fetch(self, request, response):
+        query = urlparse.parse_qs(urlparse.urlparse(request.url()).query)
+        token_type = 'id_token' if 'id_token' in query else 'access_token'
+        token = query.get(token_type, [''])[0]
+        with self.lock:
+            self.calls.append((token_type, token))
+            failed = self.failures > 0
+            self.failures -= 1 if failed else 0
+
+        if failed:
+            status, body = 500, {'error': 'backend_error'}
+        elif (token in self.tokens and
+              (token_type == 'id_token') == (token in self.idTokens)):
+            status, body = 200, {'user_id': self.tokens[token],
+                                 'expires_in': self.expiresIn}
+        else:
+            status, body = 400, {'error': 'invalid_token'}
+        response.set_statuscode(status)
+        response.set_content(json.dumps(body))
+        response.set_finalurl(request.url())
+
+
+def install(**kwargs):
+    """Replace the urlfetch stub of the active testbed with a
+    FakeTokeninfoStub built from kwargs, returning it."""
+    stub = FakeTokeninfoStub(**kwargs)
+    apiproxy_stub_map.apiproxy.ReplaceStub('urlfetch', stub)
+    return stub
@@ -1,38 +1,124 @@
+import hashlib
 import json
 import os
+import threading
 import time
 import uuid
 
 from google.appengine.api import urlfetch
+from google.appengine.ext import ndb
 from models import Profile
 
+TOKENINFO_CACHE_TTL = 300       # longest a verified token is trusted, in seconds
+TOKENINFO_CACHE_SIZE = 1000     # tokens remembered per instance
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+TOKENINFO_ATTEMPTS = 3
+TOKENINFO_DEADLINE = 5          # total seconds to spend verifying a token
+MEMCACHE_TOKENINFO_PREFIX = 'TOKENINFO:'
+
+# token hash -> (expiry time, user ID) of tokens verified by tokeninfo
+_tokeninfo_cache = {}
+_tokeninfo_cache_lock = threading.Lock()
+
+
+def _tokenHash(token):
+    """Return hash to key a token by, so raw tokens aren't kept around."""
+    return hashlib.sha256(token).hexdigest()
+
+
+def _getCachedUserId(token_hash):
+    """Return user ID cached for a token hash, or None if expired."""
+    with _tokeninfo_cache_lock:
+        entry = _tokeninfo_cache.get(token_hash)
+        if entry and entry[0] > time.time():
+            return entry[1]
+        _tokeninfo_cache.pop(token_hash, None)
+        return None
+
+
+def _cacheUserId(token_hash, user_id, expires_in=None):
+    """Cache user ID of a verified token until it expires, or at most
+    TOKENINFO_CACHE_TTL seconds."""
+    ttl = TOKENINFO_CACHE_TTL
+    if expires_in:
+        ttl = min(ttl, int(expires_in))
+    now = time.time()
+    with _tokeninfo_cache_lock:
+        if len(_tokeninfo_cache) >= TOKENINFO_CACHE_SIZE:
+            for key in [key for key, (expires, _) in _tokeninfo_cache.items()
+                        if expires <= now]:
+                del _tokeninfo_cache[key]
+        if len(_tokeninfo_cache) >= TOKENINFO_CACHE_SIZE:
+            _tokeninfo_cache.clear()
+        _tokeninfo_cache[token_hash] = (now + ttl, user_id)
+
+
+@ndb.tasklet
+def getOAuthUserIdAsync():
+    """Return future user ID of the request's OAuth bearer token, looked
+    up with tokeninfo within TOKENINFO_DEADLINE seconds; '' if the token
+    couldn't be verified. Verified tokens are cached in memcache too, so
+    instances share them."""
+    auth = os.getenv('HTTP_AUTHORIZATION')
+    bearer, token = auth.split()
+    # tokens already verified skip the tokeninfo round trips
+    token_hash = _tokenHash(token)
+    user_id = _getCachedUserId(token_hash)
+    if user_id:
+        raise ndb.Return(user_id)
+    ctx = ndb.get_context()
+    cached = yield ctx.memcache_get(MEMCACHE_TOKENINFO_PREFIX + token_hash)
+    if cached:
+        user_id, expires = cached
+        if expires > time.time():
+            _cacheUserId(token_hash, user_id, max(1, expires - time.time()))
+            raise ndb.Return(user_id)
+
+    token_type = 'id_token'
+    if 'OAUTH_USER_ID' in os.environ:
+        token_type = 'access_token'
+    url = TOKENINFO_URL % (token_type, token)
+    user = {}
+    wait = 1
+    deadline = time.time() + TOKENINFO_DEADLINE
+    for i in range(TOKENINFO_ATTEMPTS):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        try:
+            resp = yield ctx.urlfetch(url, deadline=remaining)
+        except urlfetch.Error:
+            resp = None
+        if resp and resp.status_code == 200:
+            user = json.loads(resp.content)
+            break
+        elif (resp and resp.status_code == 400 and
+              'invalid_token' in resp.content):
+            url = TOKENINFO_URL % ('access_token', token)
+        else:
+            # back off without blocking other tasklets, within the budget
+            pause = min(wait, deadline - time.time())
+            if pause > 0:
+                yield ndb.sleep(pause)
+            wait = wait + i
+
+    user_id = user.get('user_id', '')
+    if user_id:
+        ttl = min(TOKENINFO_CACHE_TTL, int(user.get('expires_in') or
+                                           TOKENINFO_CACHE_TTL))
+        _cacheUserId(token_hash, user_id, ttl)
+        yield ctx.memcache_set(MEMCACHE_TOKENINFO_PREFIX + token_hash,
+                               (user_id, time.time() + ttl), time=ttl)
+    raise ndb.Return(user_id)
+
+
 def getUserId(user, id_type="email"):
     if id_type == "email":
         return user.email()
 
     if id_type == "oauth":
         """A workaround implementation for getting userid."""
-        auth = os.getenv('HTTP_AUTHORIZATION')
-        bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return getOAuthUserIdAsync().get_result()
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm